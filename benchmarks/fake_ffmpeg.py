@@ -0,0 +1,34 @@
+"""
+ffmpeg 的替身：轉檔時直接複製輸入檔，解碼為 PCM（輸出到 -）時依檔案內容產生固定的雜訊，
+讓音訊指紋的計算與比對照常進行
+"""
+import os
+import sys
+import random
+import shutil
+import zlib
+
+def log_call(name):
+    log_path = os.environ.get("FAKE_TOOLS_LOG")
+    if log_path:
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(name + "\n")
+
+def main(argv):
+    log_call("ffmpeg")
+    source_path = argv[argv.index("-i") + 1]
+    output_path = argv[-1]
+
+    if output_path == "-":
+        seconds = float(argv[argv.index("-t") + 1]) if "-t" in argv else 60
+        sample_rate = int(argv[argv.index("-ar") + 1]) if "-ar" in argv else 11025
+        with open(source_path, 'rb') as f:
+            seed = zlib.crc32(f.read())
+        sys.stdout.buffer.write(random.Random(seed).randbytes(int(seconds * sample_rate) * 2))
+        return 0
+
+    shutil.copyfile(source_path, output_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,91 @@
+"""
+Google 試算表的替身：實作 yt-mp3.py 用到的 gspread 方法，記錄每種 API 呼叫的次數並以固定延遲模擬網路往返
+"""
+import time
+import threading
+from collections import Counter
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, sheet_id, rows=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows = [list(row) for row in rows or []]
+
+    @property
+    def row_count(self):
+        return max(1, len(self.rows))
+
+    def get_all_values(self):
+        self.spreadsheet.call("get_all_values")
+        return [list(row) for row in self.rows]
+
+    def row_values(self, row):
+        self.spreadsheet.call("row_values")
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def update(self, range_name, values, **kwargs):
+        self.spreadsheet.call("update")
+        if range_name == 'A1':
+            if self.rows:
+                self.rows[0] = list(values[0])
+            else:
+                self.rows.append(list(values[0]))
+
+class FakeSpreadsheet:
+    """latency 為每次 API 呼叫增加的秒數"""
+
+    def __init__(self, sheets, latency=0.05):
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.sheets = {}
+        for title, rows in sheets.items():
+            self.sheets[title] = FakeWorksheet(self, title, len(self.sheets), rows)
+
+    def call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def worksheets(self):
+        self.call("worksheets")
+        return list(self.sheets.values())
+
+    def worksheet(self, title):
+        # gspread 的 worksheet() 每次都會重新讀取試算表的中繼資料
+        self.call("worksheet")
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows=1, cols=10):
+        self.call("add_worksheet")
+        self.sheets[title] = FakeWorksheet(self, title, len(self.sheets))
+        return self.sheets[title]
+
+    def batch_update(self, body):
+        self.call("batch_update")
+        sheets_by_id = {sheet.id: sheet for sheet in self.sheets.values()}
+        for request in body.get("requests", []):
+            if "appendCells" in request:
+                append = request["appendCells"]
+                for row in append["rows"]:
+                    values = [next(iter(cell["userEnteredValue"].values())) for cell in row["values"]]
+                    sheets_by_id[append["sheetId"]].rows.append([str(value) for value in values])
+            elif "updateCells" in request:
+                update = request["updateCells"]
+                cell_range = update["range"]
+                rows = sheets_by_id[cell_range["sheetId"]].rows
+                for offset, row in enumerate(update["rows"]):
+                    target = rows[cell_range["startRowIndex"] + offset]
+                    values = [str(next(iter(cell["userEnteredValue"].values()))) for cell in row["values"]]
+                    start = cell_range["startColumnIndex"]
+                    target.extend([""] * (start + len(values) - len(target)))
+                    target[start:start + len(values)] = values
+            elif "deleteDimension" in request:
+                cell_range = request["deleteDimension"]["range"]
+                del sheets_by_id[cell_range["sheetId"]].rows[cell_range["startIndex"]:cell_range["endIndex"]]
@@ -0,0 +1,82 @@
+"""
+yt-dlp 子程序的替身：搜尋時輸出固定格式的 JSON，下載時寫出合成的 MP3 並依 --print 輸出影片資訊
+每次執行都會在 FAKE_TOOLS_LOG 指定的檔案追加一行，供基準測試統計呼叫次數
+"""
+import os
+import sys
+import json
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from make_library import make_mp3_bytes, video_id_for
+
+def log_call(name):
+    log_path = os.environ.get("FAKE_TOOLS_LOG")
+    if log_path:
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(name + "\n")
+
+def video_info(video_id, title):
+    return {
+        "id": video_id,
+        "title": title,
+        "channel": "合成頻道",
+        "uploader": "合成頻道",
+        "duration": 180 + zlib.crc32(video_id.encode()) % 120,
+        "view_count": zlib.crc32(title.encode()) % 1000000,
+        "upload_date": "20240101",
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        "acodec": "mp3",
+        "ext": "mp3"
+    }
+
+def search(query, flat):
+    prefix, _, terms = query.partition(":")
+    count = int(prefix[len("ytsearch"):] or 1) if prefix.startswith("ytsearch") else 1
+    for i in range(count):
+        video_id = video_id_for(zlib.crc32(f"{terms}/{i}".encode()))
+        info = video_info(video_id, f"{terms} 結果 {i + 1}")
+        if flat:
+            info = {key: info[key] for key in ("id", "title", "channel", "duration", "view_count")}
+            info["url"] = f"https://www.youtube.com/watch?v={video_id}"
+        print(json.dumps(info, ensure_ascii=False), flush=True)
+
+def playlist(url):
+    """播放清單或頻道：逐筆輸出扁平項目，每一頁之間模擬網路延遲"""
+    size = int(os.environ.get("FAKE_PLAYLIST_SIZE", "20"))
+    for i in range(size):
+        if i and i % 10 == 0:
+            time.sleep(float(os.environ.get("FAKE_PLAYLIST_PAGE_LATENCY", "0.2")))
+        video_id = video_id_for(zlib.crc32(f"{url}/{i}".encode()))
+        print(json.dumps({
+            "id": video_id,
+            "title": f"清單歌曲 {i + 1}",
+            "url": f"https://www.youtube.com/watch?v={video_id}",
+            "duration": 200
+        }, ensure_ascii=False), flush=True)
+
+def download(url, output_template, print_info):
+    video_id = url.rsplit("=", 1)[-1].rsplit("/", 1)[-1][:11]
+    info = video_info(video_id, f"合成下載 {video_id}")
+    path = output_template.replace("%(title)s", info["title"]).replace("%(ext)s", "mp3")
+    with open(path, 'wb') as f:
+        f.write(make_mp3_bytes(info["title"], info["channel"], "合成專輯", info["duration"]))
+    if print_info:
+        info["filepath"] = path
+        print(json.dumps(info, ensure_ascii=False))
+
+def main(argv):
+    log_call("yt-dlp")
+    time.sleep(float(os.environ.get("FAKE_YTDLP_LATENCY", "0")))
+    target = argv[-1]
+    if "--dump-json" in argv and not target.startswith("ytsearch"):
+        playlist(target)
+    elif "--dump-json" in argv:
+        search(target, "--flat-playlist" in argv)
+    else:
+        download(target, argv[argv.index("-o") + 1], "--print" in argv)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
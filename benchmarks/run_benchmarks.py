@@ -0,0 +1,189 @@
+"""
+離線基準測試：以合成音樂庫、yt-dlp/ffmpeg 替身與試算表替身量測每首歌的處理成本，
+不連線到 YouTube 或 Google。每個規模報告牆鐘時間、API 呼叫次數（試算表、yt-dlp、ffmpeg）與峰值記憶體
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 50000
+    python benchmarks/run_benchmarks.py --sizes 1000 --json results.json
+
+yt-mp3.py 需要的第三方套件（numpy、mutagen）照常安裝；gspread、google.colab 與 yt_dlp 都不需要
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+from collections import Counter
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, benchmark_dir)
+from make_library import generate_library, video_id_for
+from fake_gspread import FakeSpreadsheet
+
+script_path = os.path.join(os.path.dirname(benchmark_dir), "yt-mp3.py")
+
+def load_script():
+    """以 importlib 載入 yt-mp3.py；每個規模都重新載入，避免快取與索引互相影響"""
+    spec = importlib.util.spec_from_file_location("yt_mp3", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def install_fake_tools(work_dir, log_path):
+    """在 PATH 最前面放入 yt-dlp 與 ffmpeg 替身"""
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in (("yt-dlp", "fake_ytdlp.py"), ("ffmpeg", "fake_ffmpeg.py")):
+        wrapper = os.path.join(bin_dir, name)
+        with open(wrapper, 'w', encoding='utf-8') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(benchmark_dir, script)}" "$@"\n')
+        os.chmod(wrapper, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["FAKE_TOOLS_LOG"] = log_path
+
+def build_sheets(module, library):
+    """依合成音樂庫建立試算表內容：下載記錄與各分類工作表都已有對應的記錄"""
+    sheets = {name: [list(module.sheet_headers)] for name in ["下載記錄"] + list(module.category_folders)}
+    for index, (path, category, title, artist, album, seconds, url) in enumerate(library, 1):
+        row = [
+            str(index), "2024-01-01 00:00:00", os.path.basename(path), url,
+            title, artist, album, module.format_duration_seconds(seconds), "1.23 KB", category
+        ]
+        sheets["下載記錄"].append(row)
+        sheets[category].append(row)
+    return sheets
+
+def read_tool_calls(log_path):
+    try:
+        with open(log_path, 'r', encoding='utf-8') as f:
+            return Counter(line.strip() for line in f if line.strip())
+    except OSError:
+        return Counter()
+
+def measure(name, function, spreadsheet, log_path, repeat=1):
+    """執行 function repeat 次，回傳牆鐘時間、各類 API 呼叫次數與峰值記憶體"""
+    sheet_calls_before = spreadsheet.total_calls()
+    tool_calls_before = read_tool_calls(log_path)
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(repeat):
+        function(i)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tool_calls = read_tool_calls(log_path) - tool_calls_before
+
+    return {
+        "name": name,
+        "repeat": repeat,
+        "seconds": elapsed,
+        "per_call_ms": elapsed / repeat * 1000,
+        "sheet_calls": spreadsheet.total_calls() - sheet_calls_before,
+        "ytdlp_calls": tool_calls.get("yt-dlp", 0),
+        "ffmpeg_calls": tool_calls.get("ffmpeg", 0),
+        "peak_mb": peak / (1024 * 1024)
+    }
+
+def run_scale(size, args):
+    work_dir = tempfile.mkdtemp(prefix=f"yt_mp3_bench_{size}_")
+    log_path = os.path.join(work_dir, "tool_calls.log")
+    install_fake_tools(work_dir, log_path)
+    try:
+        print(f"\n產生 {size} 個檔案的合成音樂庫...")
+        music_root = os.path.join(work_dir, "MUSIC")
+        library = generate_library(music_root, size)
+
+        module = load_script()
+        module.configure_storage(music_root)
+        module.staging_dir = os.path.join(work_dir, "staging")
+        module.cache_dir = os.path.join(work_dir, "cache")
+        module.search_cache_path = os.path.join(module.cache_dir, "search_cache.json")
+        os.makedirs(module.staging_dir, exist_ok=True)
+        os.makedirs(module.cache_dir, exist_ok=True)
+        module.use_inprocess_ytdlp = False
+        module.prompt_policies.update({
+            "similar_action": "3",
+            "similar_delete_old": "n",
+            "rename": "",
+            "duplicate_overwrite": "n",
+            "name_conflict_overwrite": "n"
+        })
+
+        spreadsheet = FakeSpreadsheet(build_sheets(module, library), latency=args.latency)
+        module.spreadsheet = spreadsheet
+        module.worksheet = spreadsheet.sheets["下載記錄"]
+
+        category = module.parse_category("英文歌")
+        output_dir = module.get_output_directory(category)
+        samples = [entry for entry in library if entry[1] == category]
+
+        def similar(i):
+            path, _, title, artist, album, seconds, _ = samples[i % len(samples)]
+            metadata = {'title': title, 'artist': artist, 'album': album,
+                        'duration': module.format_duration_seconds(seconds)}
+            module.find_similar_files(metadata, path + ".new", output_dir)
+
+        def duplicate(i):
+            path, _, title, artist, album, seconds, _ = samples[i % len(samples)]
+            metadata = {'title': title, 'artist': artist, 'album': album,
+                        'duration': module.format_duration_seconds(seconds)}
+            module.check_duplicate_and_handle(os.path.basename(path) + ".new.mp3", metadata, path, category)
+
+        def add_record(i):
+            path = samples[i % len(samples)][0]
+            module.add_record_to_google_sheet(f"新記錄 {i}.mp3", f"https://youtu.be/{video_id_for(10 ** 9 + i)}",
+                                              path, module.get_audio_metadata(path), category)
+
+        def download(i):
+            url = f"https://www.youtube.com/watch?v={video_id_for(2 * 10 ** 9 + i)}"
+            module.download_as_mp3(url, "", category=category, ask_category=False)
+
+        results = [
+            measure("find_similar_files（首次，含索引建立）", similar, spreadsheet, log_path),
+            measure("find_similar_files", similar, spreadsheet, log_path, args.repeat),
+            measure("check_duplicate_and_handle（首次，含鏡像載入）", duplicate, spreadsheet, log_path),
+            measure("check_duplicate_and_handle", duplicate, spreadsheet, log_path, args.repeat),
+            measure("add_record_to_google_sheet", add_record, spreadsheet, log_path, args.repeat),
+            measure("flush_sheet_writes", lambda i: module.flush_sheet_writes(), spreadsheet, log_path),
+            measure("download_as_mp3", download, spreadsheet, log_path, args.downloads),
+            measure("搬移與寫入收尾", lambda i: (module.wait_for_pending_moves(), module.flush_sheet_writes()),
+                    spreadsheet, log_path),
+        ]
+        for result in results:
+            result["size"] = size
+        module.flush_sheet_writes()
+        return results
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def print_results(results):
+    print(f"\n{'規模':>7}  {'項目':<36}{'次數':>5}{'總秒數':>9}{'每次ms':>10}{'試算表':>7}{'yt-dlp':>7}{'ffmpeg':>7}{'峰值MB':>8}")
+    for r in results:
+        print(f"{r['size']:>7}  {r['name']:<36}{r['repeat']:>5}{r['seconds']:>9.3f}{r['per_call_ms']:>10.2f}"
+              f"{r['sheet_calls']:>7}{r['ytdlp_calls']:>7}{r['ffmpeg_calls']:>7}{r['peak_mb']:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="yt-mp3.py 離線基準測試")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="合成音樂庫的檔案數量")
+    parser.add_argument("--repeat", type=int, default=50, help="查詢類項目的重複次數")
+    parser.add_argument("--downloads", type=int, default=5, help="download_as_mp3 的下載次數")
+    parser.add_argument("--latency", type=float, default=0.05, help="每次試算表 API 呼叫的模擬延遲（秒）")
+    parser.add_argument("--json", help="將結果另存為 JSON，方便比較不同版本")
+    parser.add_argument("--keep", action="store_true", help="保留暫存資料夾")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_scale(size, args))
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
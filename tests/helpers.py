@@ -0,0 +1,80 @@
+"""
+測試共用：載入 yt-mp3.py 為模組，並在暫存資料夾中建立音樂庫與暫存區
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+script_path = os.path.join(os.path.dirname(tests_dir), "yt-mp3.py")
+# 離線替身（試算表、yt-dlp、ffmpeg）與測試音樂庫產生器放在 benchmarks 中
+sys.path.insert(0, os.path.join(os.path.dirname(tests_dir), "benchmarks"))
+
+video_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("yt_mp3", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class ScriptTestCase(unittest.TestCase):
+    """每個測試重新載入程式，音樂庫位於 work_dir/MUSIC，暫存區位於 work_dir/staging"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        self.module = load_script()
+        self.module.configure_storage(os.path.join(self.work_dir, "MUSIC"))
+        self.module.staging_dir = os.path.join(self.work_dir, "staging")
+        os.makedirs(self.module.staging_dir)
+        self.module.cache_dir = os.path.join(self.work_dir, "cache")
+        self.module.search_cache_path = os.path.join(self.module.cache_dir, "search_cache.json")
+
+    def use_fake_spreadsheet(self, latency=0):
+        """以 benchmarks 的試算表替身取代 Google 試算表，每個工作表只有標題列"""
+        from fake_gspread import FakeSpreadsheet
+        sheets = {name: [list(self.module.sheet_headers)] for name in ["下載記錄"] + list(self.module.category_folders)}
+        self.spreadsheet = FakeSpreadsheet(sheets, latency=latency)
+        self.module.spreadsheet = self.spreadsheet
+        # 替身沒有配額，不受每分鐘請求預算限制
+        self.module.sheet_read_budget = self.module.TokenBucket(10 ** 6, 10 ** 6)
+        self.module.sheet_write_budget = self.module.TokenBucket(10 ** 6, 10 ** 6)
+        return self.spreadsheet
+
+    def stage_mp3(self, filename, title, seconds=200, artist="演出者"):
+        """在暫存區建立一個下載完成的小型 MP3（與轉檔後相同，每個下載有自己的暫存資料夾）"""
+        from make_library import make_mp3_bytes
+        path = os.path.join(tempfile.mkdtemp(dir=self.module.staging_dir), filename)
+        with open(path, 'wb') as f:
+            f.write(make_mp3_bytes(title, artist, "專輯", seconds))
+        return path
+
+    def use_fake_downloads(self):
+        """
+        以暫存區中產生的 MP3 取代 start_download 的下載與轉檔，不連線也不需要 ffmpeg；
+        標題取自網址中的影片 ID，回傳的項目與 start_download 相同，交給 finish_download 處理
+        """
+        from concurrent.futures import Future
+        self.downloaded_urls = []
+
+        def start_download(youtube_url, extra_params="", category=None, file_name=None):
+            self.downloaded_urls.append(youtube_url)
+            video_id = self.module.extract_video_id(youtube_url)
+            staged_path = self.stage_mp3(f"{video_id}.mp3", video_id, seconds=120 + len(self.downloaded_urls))
+            future = Future()
+            future.set_result((staged_path, ""))
+            return {
+                'url': youtube_url,
+                'category': category,
+                'file_name': file_name,
+                'output_dir': self.module.get_output_directory(category),
+                'staging_dir': os.path.dirname(staged_path),
+                'reason': "",
+                'future': future,
+                'timing_item': {'url': youtube_url, 'category': category}
+            }
+        self.module.start_download = start_download
@@ -0,0 +1,35 @@
+"""
+頻寬調節：吞吐量只取自 yt-dlp 進度回呼中的傳輸資料，不含影片解析的時間
+"""
+import time
+
+from helpers import ScriptTestCase, video_url
+
+class TransferMeasurementTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.module.bandwidth_governor.configure(True)
+        self.module.get_transcode_pool = lambda: self.fail("不應進入轉檔")
+
+    def fake_download(self, transfer_bytes, transfer_seconds, extraction_seconds):
+        def ytdlp_download(youtube_url, cli_args, output_template=None):
+            # 解析頁面與播放器的時間不算在傳輸內
+            time.sleep(extraction_seconds)
+            self.module.ytdlp_progress_hook({
+                'status': 'finished', 'downloaded_bytes': transfer_bytes, 'elapsed': transfer_seconds
+            })
+            return True, "", None, {}
+        self.module.ytdlp_download = ytdlp_download
+
+    def test_saturated_transfer_raises_limit(self):
+        governor = self.module.bandwidth_governor
+        limit = self.module.parse_rate_limit(governor.current_limit())
+        self.fake_download(int(limit * 0.9), 1.0, 0.3)
+        level = governor.level
+        self.module.start_download(video_url, "", "英文歌")
+        self.assertEqual(governor.level, level + 1)
+        self.assertAlmostEqual(governor.samples[-1], limit * 0.9, delta=1)
+
+    def test_already_downloaded_file_is_not_a_sample(self):
+        self.module.ytdlp_progress_hook({'status': 'finished', 'total_bytes': 1024})
+        self.assertIsNone(getattr(self.module.ytdlp_engines, 'last_transfer', None))
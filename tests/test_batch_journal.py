@@ -0,0 +1,68 @@
+"""
+批次日誌：每個項目最後的狀態決定繼續下載時要略過哪些項目
+"""
+import time
+from unittest import mock
+
+from helpers import ScriptTestCase
+
+def video_urls(count):
+    return [f"https://www.youtube.com/watch?v=video{index:06d}" for index in range(count)]
+
+class BatchJournalTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_fake_spreadsheet()
+        self.use_fake_downloads()
+        self.module.prompt_policies.update({
+            "rename": "", "name_conflict_overwrite": "n", "similar_action": "3", "duplicate_overwrite": "n"
+        })
+
+    def run_batch(self, urls):
+        jobs = [(url, "英文歌", None) for url in urls]
+        journal_path = self.module.create_batch_journal(jobs)
+        success_count = self.module.run_batch_downloads(jobs, workers=3, journal_path=journal_path)
+        self.journal_path = journal_path
+        return success_count, self.module.load_batch_journal(journal_path)
+
+    def test_moved_items_end_done_with_slow_journal_writes(self):
+        # 日誌寫入（fsync）比搬移慢時，搬移完成的 done 仍須是最後的狀態
+        append_journal_record = self.module.append_journal_record
+
+        def slow_append(*args, **kwargs):
+            time.sleep(0.05)
+            return append_journal_record(*args, **kwargs)
+        self.module.append_journal_record = slow_append
+
+        success_count, states = self.run_batch(video_urls(6))
+        self.assertEqual(success_count, 6)
+        self.assertEqual({record["state"] for record in states.values()}, {"done"})
+
+    def test_deleted_similar_download_is_skipped_and_owned(self):
+        from make_library import make_mp3_bytes
+        url = video_urls(1)[0]
+        video_id = self.module.extract_video_id(url)
+        # 音樂庫中已有標題與時長相同的檔案（假下載的第一首為 121 秒）
+        with open(f"{self.module.category_folders['英文歌']}/舊檔.mp3", 'wb') as f:
+            f.write(make_mp3_bytes(video_id, "演出者", "專輯", 121))
+        self.module.prompt_policies.update({"similar_action": "2", "similar_delete_old": "n"})
+
+        completed, states = self.run_batch([url])
+        self.assertEqual(completed, 1)
+        self.assertEqual(states[url]["state"], "skipped")
+        self.assertTrue(self.module.is_video_owned(url))
+
+    def test_resume_downloads_only_unfinished_items(self):
+        urls = video_urls(4)
+        self.run_batch(urls)
+        # 模擬中斷：一個項目下載失敗、一個項目搬移途中執行階段重置
+        self.module.append_journal_record(self.journal_path, urls[1], "英文歌", "failed", "rate_limited")
+        self.module.append_journal_record(self.journal_path, urls[2], "英文歌", "moving")
+        self.downloaded_urls.clear()
+        self.module.prompt_batch_settings = lambda extra_params: (extra_params, 2, None)
+
+        with mock.patch("builtins.input", return_value="1"):
+            self.module.resume_batch_download()
+        self.assertEqual(sorted(self.downloaded_urls), [urls[1], urls[2]])
+        states = self.module.load_batch_journal(self.journal_path)
+        self.assertEqual({record["state"] for record in states.values()}, {"done"})
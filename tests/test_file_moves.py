@@ -0,0 +1,48 @@
+"""
+暫存區的完成檔搬移到分類資料夾：保持原檔名時也不可覆蓋同名的檔案
+"""
+import os
+import threading
+
+from helpers import ScriptTestCase, video_url
+
+class NameConflictTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_fake_spreadsheet()
+        # 與無人值守模式的預設相同：不改名、不覆蓋、相似檔案全部保留
+        self.module.prompt_policies.update({
+            "rename": "", "name_conflict_overwrite": "n", "similar_action": "3", "duplicate_overwrite": "n"
+        })
+        self.folder = self.module.category_folders["英文歌"]
+
+    def handle(self, staged_path):
+        return self.module.handle_downloaded_file(staged_path, video_url, self.folder, "英文歌")
+
+    def test_kept_name_does_not_overwrite_existing_file(self):
+        existing = os.path.join(self.folder, "Song.mp3")
+        with open(existing, 'wb') as f:
+            f.write(b"existing song")
+        self.assertTrue(self.handle(self.stage_mp3("Song.mp3", "Another Song")))
+        self.module.wait_for_pending_moves()
+        with open(existing, 'rb') as f:
+            self.assertEqual(f.read(), b"existing song")
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "Song (2).mp3")))
+
+    def test_same_title_downloads_do_not_share_a_move(self):
+        # 第一個檔案搬移中（尚未出現在分類資料夾）時處理第二個同名檔案
+        gate = threading.Event()
+        move_staged_file = self.module.move_staged_file
+
+        def slow_move(*args):
+            gate.wait()
+            return move_staged_file(*args)
+        self.module.move_staged_file = slow_move
+
+        first = self.stage_mp3("Song.mp3", "Song", seconds=200)
+        second = self.stage_mp3("Song.mp3", "Song", seconds=201)
+        self.assertTrue(self.handle(first))
+        self.assertTrue(self.handle(second))
+        gate.set()
+        self.module.wait_for_pending_moves()
+        self.assertEqual(sorted(os.listdir(self.folder)), ["Song (2).mp3", "Song.mp3"])
@@ -0,0 +1,49 @@
+"""
+音訊指紋：開頭長度不同的重新上傳仍要比對得到，不同的歌則不可
+"""
+import os
+
+import numpy as np
+
+from helpers import ScriptTestCase
+
+def synthetic_song(seed, seconds=100, sample_rate=11025):
+    """隨機音高、長度 0.15-0.5 秒的泛音音符接續而成的單聲道 PCM"""
+    rng = np.random.default_rng(seed)
+    notes = []
+    length = 0
+    while length < seconds * sample_rate:
+        t = np.arange(int(rng.uniform(0.15, 0.5) * sample_rate)) / sample_rate
+        frequency = 110 * 2 ** (rng.integers(0, 36) / 12)
+        tone = sum(np.sin(2 * np.pi * frequency * k * t) / k for k in range(1, 5))
+        notes.append(tone * np.minimum(1, np.arange(len(t)) / 200) * np.exp(-t * 3))
+        length += len(t)
+    samples = np.concatenate(notes)[:seconds * sample_rate] + rng.normal(0, 0.05, seconds * sample_rate)
+    return (samples / np.abs(samples).max() * 12000).astype(np.int16)
+
+class OffsetMatchTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.song = synthetic_song(1)
+        self.library_file = self.add_to_library("原版.mp3", self.song)
+
+    def add_to_library(self, filename, samples):
+        from make_library import make_mp3_bytes
+        path = os.path.join(self.module.category_folders["英文歌"], filename)
+        with open(path, 'wb') as f:
+            f.write(make_mp3_bytes(filename, "演出者", "專輯", 100))
+        self.module.update_library_index(path, fingerprint=self.module.compute_fingerprint(samples))
+        return path
+
+    def matches(self, samples):
+        fingerprint = self.module.compute_fingerprint(samples)
+        return [path for path, _ in self.module.find_fingerprint_matches(fingerprint, "新下載.mp3")]
+
+    def test_offset_reupload_matches(self):
+        offset = int(0.7 * self.module.fingerprint_sample_rate)
+        lead_in = np.random.default_rng(2).normal(0, 3000, offset).astype(np.int16)
+        self.assertEqual(self.matches(np.concatenate([lead_in, self.song])), [self.library_file])
+        self.assertEqual(self.matches(self.song[offset:]), [self.library_file])
+
+    def test_different_song_does_not_match(self):
+        self.assertEqual(self.matches(synthetic_song(2)), [])
@@ -0,0 +1,53 @@
+"""
+無人值守模式：main() 依命令列參數執行，所有提示依策略回答，有項目失敗時回傳非零
+"""
+import os
+
+from helpers import ScriptTestCase
+
+urls = [f"https://www.youtube.com/watch?v=video{index:06d}" for index in range(3)]
+
+class HeadlessMainTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_fake_spreadsheet()
+        self.use_fake_downloads()
+        self.module.initialize_google_sheet = lambda: True
+        # main() 會重新設定儲存位置；暫存區與快取仍留在測試的暫存資料夾中
+        configure_storage = self.module.configure_storage
+        staging_dir, cache_dir = self.module.staging_dir, self.module.cache_dir
+
+        def configure_test_storage(music_root=None):
+            configure_storage(music_root)
+            self.module.staging_dir, self.module.cache_dir = staging_dir, cache_dir
+        self.module.configure_storage = configure_test_storage
+
+        self.input_path = os.path.join(self.work_dir, "input.txt")
+        with open(self.input_path, 'w', encoding='utf-8') as f:
+            f.write("# 每行一個網址\n" + "\n".join(f"{url} | 英文歌" for url in urls) + "\n")
+
+    def main(self, *args):
+        return self.module.main([self.input_path, "--music-dir", self.module.base_output_dir,
+                                 "--rpm", "0", "--workers", "2", *args])
+
+    def test_all_downloads_succeed(self):
+        self.assertEqual(self.main(), 0)
+        self.assertEqual(sorted(self.downloaded_urls), urls)
+        self.assertEqual(sorted(os.listdir(self.module.category_folders["英文歌"])),
+                         sorted(f"{self.module.extract_video_id(url)}.mp3" for url in urls))
+
+    def test_failed_download_returns_nonzero(self):
+        start_download = self.module.start_download
+
+        def failing_start_download(youtube_url, *args):
+            pending = start_download(youtube_url, *args)
+            if youtube_url == urls[1]:
+                pending.update(future=None, reason="unavailable")
+            return pending
+        self.module.start_download = failing_start_download
+        self.assertEqual(self.main(), 1)
+
+    def test_owned_videos_are_skipped(self):
+        self.module.mark_video_owned(urls[0])
+        self.assertEqual(self.main(), 0)
+        self.assertEqual(sorted(self.downloaded_urls), urls[1:])
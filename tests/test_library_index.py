@@ -0,0 +1,47 @@
+"""
+音樂庫索引：資料夾第一次同步時整批寫入，只提交一次
+"""
+import os
+
+from helpers import ScriptTestCase
+from make_library import generate_library
+
+class CountingConnection:
+    """記錄 commit 次數的 sqlite3 連線包裝"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        return self.conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class FolderSyncTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = generate_library(self.module.base_output_dir, 40)
+        # 先由程式建立資料表，之後的提交才開始計數
+        self.module.library_index_conn = CountingConnection(self.module.get_library_index())
+
+    def indexed_paths(self, folder):
+        return {path for (path,) in self.module.library_index_conn.execute(
+            "SELECT path FROM library_files WHERE folder = ?", (folder,))}
+
+    def test_first_sync_commits_once(self):
+        folder = self.module.category_folders["英文歌"]
+        self.module.sync_library_folder(folder)
+        self.assertEqual(self.module.library_index_conn.commits, 1)
+        expected = {path for path, category, *_ in self.library if category == "英文歌"}
+        self.assertEqual(self.indexed_paths(folder), expected)
+
+        removed = sorted(expected)[:3]
+        for path in removed:
+            os.remove(path)
+        self.module.library_index_conn.commits = 0
+        self.module.sync_library_folder(folder, force=True)
+        self.assertEqual(self.module.library_index_conn.commits, 1)
+        self.assertEqual(self.indexed_paths(folder), expected - set(removed))
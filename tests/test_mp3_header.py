@@ -0,0 +1,68 @@
+"""
+只讀檔頭的 MP3 元數據讀取：CBR 依位元率估算、Xing 標頭的總框架數，以及跳過大型封面框架
+"""
+import os
+import struct
+
+from helpers import ScriptTestCase
+from make_library import frame_header, frame_size, id3_text_frame, make_mp3_bytes, syncsafe
+
+def cbr_frames(count):
+    """128 kbps、44.1 kHz 的靜音框架，沒有 Xing 標頭"""
+    return (frame_header + b'\x00' * (frame_size - 4)) * count
+
+def id3v2_tag(*frames):
+    body = b''.join(frames)
+    return b'ID3\x03\x00\x00' + syncsafe(len(body)) + body
+
+def apic_frame(image_size):
+    data = b'\x00image/jpeg\x00\x03\x00' + b'\xff' * image_size
+    return b'APIC' + struct.pack('>I', len(data)) + b'\x00\x00' + data
+
+class Mp3HeaderTest(ScriptTestCase):
+    def write(self, filename, data):
+        path = os.path.join(self.work_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        return self.module.read_mp3_metadata(path, os.path.getsize(path))
+
+    def test_cbr_duration_from_bitrate(self):
+        tag = id3v2_tag(id3_text_frame('TIT2', "CBR 歌"))
+        path = self.write("cbr.mp3", tag + cbr_frames(1000))
+        tags, duration = self.read(path)
+        self.assertEqual(tags['title'], "CBR 歌")
+        self.assertAlmostEqual(duration, 1000 * frame_size * 8 / 128000, places=3)
+
+    def test_cbr_excludes_id3v1_tag(self):
+        path = self.write("id3v1.mp3", cbr_frames(1000) + b'TAG' + b'\x00' * 125)
+        tags, duration = self.read(path)
+        self.assertAlmostEqual(duration, 1000 * frame_size * 8 / 128000, places=3)
+
+    def test_xing_frame_count(self):
+        path = self.write("xing.mp3", make_mp3_bytes("標題", "演出者", "專輯", 245))
+        tags, duration = self.read(path)
+        self.assertEqual(tags, {'title': "標題", 'artist': "演出者", 'album': "專輯"})
+        self.assertAlmostEqual(duration, 245, delta=0.05)
+        self.assertEqual(self.module.get_audio_metadata(path)['duration'], "04:04")
+
+    def test_large_cover_frame_is_skipped(self):
+        # 封面在標題之後、演出者之前，且遠大於檔頭探測的大小
+        xing = make_mp3_bytes("x", "x", "x", 180)
+        audio = xing[xing.index(frame_header):]
+        tag = id3v2_tag(id3_text_frame('TIT2', "有封面"), apic_frame(2 * 1024 * 1024),
+                        id3_text_frame('TPE1', "封面後的演出者"))
+        path = self.write("cover.mp3", tag + audio)
+        tags, duration = self.read(path)
+        self.assertEqual(tags['title'], "有封面")
+        self.assertEqual(tags['artist'], "封面後的演出者")
+        self.assertAlmostEqual(duration, 180, delta=0.05)
+
+    def test_file_smaller_than_id3v1_tag(self):
+        path = self.write("tiny.mp3", cbr_frames(1)[:100])
+        tags, duration = self.read(path)
+        self.assertEqual(tags, {})
+        self.assertAlmostEqual(duration, 100 * 8 / 128000, places=4)
+        self.assertEqual(self.module.get_audio_metadata(path)['title'], "tiny")
@@ -0,0 +1,36 @@
+"""
+已擁有的影片 ID：本地的 ID 清單加上試算表中的網址，在任何連線之前就能判斷是否略過
+"""
+import os
+
+from helpers import ScriptTestCase, load_script
+
+owned_id = "dQw4w9WgXcQ"
+new_url = "https://www.youtube.com/watch?v=9bZkp7q5F2k"
+
+class OwnedIdsTest(ScriptTestCase):
+    def test_marked_id_persists_and_matches_any_url_form(self):
+        self.module.mark_video_owned(f"https://youtu.be/{owned_id}")
+        self.module.mark_video_owned(f"https://www.youtube.com/watch?v={owned_id}&t=30")
+
+        next_session = load_script()
+        next_session.configure_storage(self.module.base_output_dir)
+        for url in (f"https://www.youtube.com/watch?v={owned_id}", f"https://www.youtube.com/shorts/{owned_id}"):
+            self.assertTrue(next_session.is_video_owned(url), url)
+        self.assertFalse(next_session.is_video_owned(new_url))
+        with open(next_session.owned_ids_path, encoding='utf-8') as f:
+            self.assertEqual(f.read().split(), [owned_id])
+
+    def test_sheet_urls_count_as_owned(self):
+        spreadsheet = self.use_fake_spreadsheet()
+        row = [""] * len(self.module.sheet_headers)
+        row[self.module.sheet_headers.index("YouTube網址")] = f"https://www.youtube.com/watch?v={owned_id}"
+        spreadsheet.sheets["下載記錄"].rows.append(row)
+        self.assertTrue(self.module.is_video_owned(f"https://youtu.be/{owned_id}"))
+        self.assertFalse(os.path.exists(self.module.owned_ids_path))
+
+    def test_headless_jobs_skip_owned_videos(self):
+        self.module.mark_video_owned(f"https://youtu.be/{owned_id}")
+        lines = [f"https://www.youtube.com/watch?v={owned_id}", new_url]
+        self.assertEqual(self.module.read_headless_jobs(lines, None), [(new_url, None, None)])
+        self.assertEqual(len(self.module.read_headless_jobs(lines, None, on_owned="download")), 2)
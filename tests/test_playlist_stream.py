@@ -0,0 +1,42 @@
+"""
+程序內逐筆列出播放清單：未處理的擷取結果是轉址時要跟隨到真正的清單
+"""
+import threading
+
+from helpers import ScriptTestCase
+
+short_link = "https://youtu.be/dQw4w9WgXcQ?list=PLtest"
+playlist_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLtest&feature=youtu.be"
+
+class StubEngine:
+    """依網址回傳預先準備的 extract_info 結果，並記錄呼叫"""
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def extract_info(self, url, download=True, ie_key=None, process=True):
+        self.calls.append((url, ie_key))
+        return self.results[url]
+
+class RedirectTest(ScriptTestCase):
+    def stream(self, results):
+        engine = StubEngine(results)
+        self.module.get_ytdlp_engine = lambda cli_args: engine
+        return list(self.module.ytdlp_search_stream(short_link, "", threading.Event())), engine
+
+    def test_url_result_is_followed(self):
+        entries = ({'id': f"video{index:05d}", 'title': f"歌 {index}"} for index in range(3))
+        results = {
+            short_link: {'_type': 'url', 'url': playlist_url, 'ie_key': 'YoutubeTab'},
+            playlist_url: {'_type': 'playlist', 'entries': entries},
+        }
+        streamed, engine = self.stream(results)
+        self.assertEqual([entry['id'] for entry in streamed], ["video00000", "video00001", "video00002"])
+        self.assertEqual(engine.calls[1], (playlist_url, 'YoutubeTab'))
+
+    def test_redirect_loop_stops(self):
+        results = {short_link: {'_type': 'url', 'url': short_link}}
+        streamed, engine = self.stream(results)
+        self.assertEqual(streamed, [])
+        self.assertEqual(len(engine.calls), 1 + self.module.max_ytdlp_url_redirects)
@@ -0,0 +1,51 @@
+"""
+核對音樂庫與試算表：補上沒有記錄的檔案、刪除檔案已不存在的記錄
+"""
+import os
+
+from helpers import ScriptTestCase
+from make_library import make_mp3_bytes
+
+class ReconcileTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spreadsheet = self.use_fake_spreadsheet()
+        self.folder = self.module.category_folders["英文歌"]
+        # 有記錄的檔案、記錄後被刪除的檔案，以及之後才放進資料夾、沒有記錄的檔案
+        self.add_recorded_file("有記錄.mp3")
+        os.remove(self.add_recorded_file("已刪除.mp3"))
+        self.write_song("沒有記錄.mp3")
+
+    def write_song(self, filename):
+        path = os.path.join(self.folder, filename)
+        with open(path, 'wb') as f:
+            f.write(make_mp3_bytes(os.path.splitext(filename)[0], "演出者", "專輯", 200))
+        return path
+
+    def add_recorded_file(self, filename):
+        path = self.write_song(filename)
+        self.module.add_record_to_google_sheet(filename, "", path, self.module.get_audio_metadata(path), "英文歌")
+        self.assertTrue(self.module.flush_sheet_writes())
+        return path
+
+    def sheet_filenames(self, sheet_name):
+        rows = self.spreadsheet.sheets[sheet_name].rows
+        column = rows[0].index("檔案名稱")
+        return sorted(row[column] for row in rows[1:])
+
+    def test_report_then_fix(self):
+        self.assertEqual(self.module.reconcile_library(), 2)
+        self.assertEqual(self.sheet_filenames("下載記錄"), ["已刪除.mp3", "有記錄.mp3"])
+
+        self.assertEqual(self.module.reconcile_library(fix=True), 2)
+        self.assertEqual(self.sheet_filenames("下載記錄"), ["有記錄.mp3", "沒有記錄.mp3"])
+        self.assertEqual(self.sheet_filenames("英文歌"), ["有記錄.mp3", "沒有記錄.mp3"])
+        self.assertEqual(self.module.reconcile_library(), 0)
+
+    def test_rows_are_kept_when_flush_fails(self):
+        def failing_batch_update(body):
+            raise ConnectionError("offline")
+        self.spreadsheet.batch_update = failing_batch_update
+        self.module.sheets_max_attempts = 1
+        self.module.reconcile_library(fix=True)
+        self.assertEqual(self.sheet_filenames("下載記錄"), ["已刪除.mp3", "有記錄.mp3"])
@@ -0,0 +1,30 @@
+"""
+搜尋結果排序：雜訊字詞（live、cover 等）的比對
+"""
+import unittest
+
+from helpers import load_script
+
+module = load_script()
+
+def video(title, channel, view_count=10 ** 7, duration=240):
+    return {'title': title, 'channel': channel, 'view_count': view_count, 'duration': duration, 'url': ''}
+
+class NoiseWordTest(unittest.TestCase):
+    def test_noise_word_inside_another_word_is_ignored(self):
+        score = module.score_search_result("Life Goes On", video("Oliver Tree - Life Goes On [Music Video]", "Oliver Tree"))
+        self.assertGreaterEqual(score, module.search_confidence_threshold)
+        score = module.score_search_result("Discover", video("Discover (Official Audio)", "Artist - Topic"))
+        self.assertGreaterEqual(score, module.search_confidence_threshold)
+
+    def test_noise_word_lowers_score(self):
+        original = module.score_search_result("Hello", video("Adele - Hello", "Adele - Topic"))
+        live = module.score_search_result("Hello", video("Adele - Hello (Live at the BBC)", "BBC"))
+        cover = module.score_search_result("晴天", video("晴天 翻唱", "某人"))
+        self.assertLess(live, original - 0.25)
+        self.assertLess(cover, module.search_confidence_threshold)
+
+    def test_noise_word_in_query_is_not_penalized(self):
+        title = "Adele - Hello (Live at the BBC)"
+        self.assertGreater(module.score_search_result("Hello live", video(title, "BBC")),
+                           module.score_search_result("Hello", video(title, "BBC")))
@@ -0,0 +1,35 @@
+"""
+試算表寫入佇列：以 benchmarks 中的試算表替身檢查寫出的先後順序
+"""
+import time
+import threading
+
+from helpers import ScriptTestCase
+
+class FlushOrderingTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_fake_spreadsheet(latency=0.2)
+
+    def test_final_flush_waits_for_write_in_flight(self):
+        for i in range(3):
+            self.module.queue_sheet_append("下載記錄", [f"值 {i}"] * (len(self.module.sheet_headers) - 1))
+        # 模擬背景寫出已取走佇列、正在送出 batch_update
+        background = threading.Thread(target=self.module.flush_sheet_writes)
+        background.start()
+        while self.module.sheet_write_queue:
+            time.sleep(0.001)
+        self.assertTrue(self.module.flush_sheet_writes())
+        self.assertEqual(len(self.spreadsheet.sheets["下載記錄"].rows), 4)
+        background.join()
+
+    def test_writes_stay_queued_without_spreadsheet(self):
+        # 記錄排入佇列後試算表連線中斷
+        self.module.queue_sheet_append("下載記錄", ["離線時的記錄"] * (len(self.module.sheet_headers) - 1))
+        self.module.spreadsheet = None
+        self.assertFalse(self.module.flush_sheet_writes())
+        self.assertEqual(len(self.module.sheet_write_queue), 1)
+
+        self.module.spreadsheet = self.spreadsheet
+        self.assertTrue(self.module.flush_sheet_writes())
+        self.assertEqual(self.spreadsheet.sheets["下載記錄"].rows[-1][1], "離線時的記錄")
@@ -0,0 +1,54 @@
+"""
+程序內 yt-dlp 引擎的失敗處理：不連線，以替換 YouTube extractor 的方式模擬 429
+"""
+from unittest import mock
+
+import yt_dlp
+from yt_dlp.extractor.youtube import YoutubeIE
+from yt_dlp.utils import ExtractorError
+
+from helpers import ScriptTestCase, video_url
+
+def raise_rate_limited(self, url):
+    raise ExtractorError("HTTP Error 429: Too Many Requests", expected=True)
+
+class InProcessFailureTest(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        self.module.use_inprocess_ytdlp = True
+        patcher = mock.patch.object(YoutubeIE, "_real_extract", raise_rate_limited)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_download_failure_is_reported(self):
+        output_template = f"{self.work_dir}/%(title)s.%(ext)s"
+        ok, error_text, file_path, info = self.module.ytdlp_download(video_url, "", output_template)
+        self.assertIsNotNone(self.module.get_ytdlp_engine(""))
+        self.assertFalse(ok)
+        self.assertIn("429", error_text)
+        self.assertIsNone(file_path)
+
+    def test_search_failure_is_not_empty_result(self):
+        with mock.patch.object(yt_dlp.YoutubeDL, "extract_info", return_value=None):
+            entries, error_text = self.module.ytdlp_search("ytsearch1:test", "--no-cache-dir")
+        self.assertIsNone(entries)
+        self.assertTrue(error_text)
+
+    def test_rate_limit_reaches_scheduler(self):
+        scheduler = self.module.download_scheduler
+        rate_before = scheduler.rate
+        self.module.max_download_attempts = 1
+        pending = self.module.start_download(video_url, "", "英文歌")
+        self.assertEqual(pending['reason'], "rate_limited")
+        self.assertIsNone(pending['future'])
+        self.assertEqual(scheduler.rate, max(self.module.min_requests_per_minute, rate_before / 2))
+        self.assertGreater(scheduler.paused_until, self.module.time.time())
+        self.assertEqual(scheduler.success_streak, 0)
+
+    def test_engine_reused_across_output_templates(self):
+        for i in range(3):
+            output_template = f"{self.work_dir}/{i}/%(title)s.%(ext)s"
+            self.module.ytdlp_download(video_url, "--no-playlist", output_template)
+            engine = self.module.get_ytdlp_engine("--no-playlist")
+            self.assertEqual(engine.params['outtmpl']['default'], output_template)
+        self.assertEqual(len(self.module.ytdlp_engines.engines), 1)
@@ -1,23 +1,42 @@
+"""
+進階 YouTube 音樂下載器
+
+在 Colab 中執行時會掛載雲端硬碟並使用其中的 MUSIC 資料夾；其他環境改用 --music-dir、
+環境變數 YT_MP3_MUSIC_DIR 或 ~/Music/MUSIC，Google Sheets 無法連線時只略過記錄
+載入本檔不會有任何副作用，所有設定與提示都在 main() 中進行。檔名含連字號，需以 importlib 載入：
+
+    spec = importlib.util.spec_from_file_location("yt_mp3", "yt-mp3.py")
+    yt_mp3 = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(yt_mp3)
+"""
 import os
 import re
+import sys
 import json
+import argparse
+import shlex
 import subprocess
-from google.colab import drive, auth
 import platform
-import glob
 import time
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TALB, TPE1, TIT2, TCON, TDRC
+import random
+import shutil
+import tempfile
+import atexit
+import sqlite3
+import struct
+import math
+import threading
+from difflib import SequenceMatcher
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-import gspread
-from google.auth import default
-import pandas as pd
+# 音樂資料夾：在 Colab 中使用掛載的雲端硬碟，其他環境使用本機資料夾；實際路徑由 configure_storage() 設定
+colab_music_root = "/content/drive/My Drive/MUSIC"
+local_music_root = os.path.join(os.path.expanduser("~"), "Music", "MUSIC")
 
-drive.mount('/content/drive', force_remount=True)
-
-base_output_dir = "/content/drive/My Drive/MUSIC"
-os.makedirs(base_output_dir, exist_ok=True)
+base_output_dir = colab_music_root
 
 category_folders = {
     "中文歌": os.path.join(base_output_dir, "中文歌"),
@@ -26,17 +45,480 @@ category_folders = {
     "純音樂": os.path.join(base_output_dir, "純音樂")
 }
 
-for folder_path in category_folders.values():
-    os.makedirs(folder_path, exist_ok=True)
-
 spreadsheet_name = "音樂資料庫"
 
 gc = None
 spreadsheet = None
 worksheet = None
 
+sheet_headers = ["序號", "日期時間", "檔案名稱", "YouTube網址", "歌曲標題", "藝術家", "專輯", "時長", "文件大小", "類別"]
+
+# 試算表寫入佇列：記錄先排入佇列，由背景執行緒每隔一段時間或累積一定筆數後批次寫入
+sheet_write_queue = []
+sheet_write_lock = threading.Lock()
+sheet_write_event = threading.Event()
+sheet_flush_lock = threading.Lock()
+sheet_writer_thread = None
+sheet_flush_interval = 15
+sheet_flush_batch_size = 20
+
+# 工作表 ID（sheetId）快取，批次寫入時不必再向 API 查詢
+sheet_ids = {}
+
+# 工作表本地鏡像：每個工作表只讀取一次，並以檔案名稱與 YouTube 網址建立雜湊索引
+# 本程式的寫入會同步更新鏡像；若在試算表中手動修改過，呼叫 refresh_sheet_mirrors() 重新載入
+sheet_mirrors = {}
+
 cache_dir = "/content/yt_dlp_cache"
-os.makedirs(cache_dir, exist_ok=True)
+
+# 音樂庫索引：以路徑為鍵記錄 mtime、大小與標籤，相似檔案檢查改為索引查詢
+library_index_path = os.path.join(base_output_dir, "library_index.sqlite")
+library_index_conn = None
+library_index_lock = threading.Lock()
+synced_library_folders = set()
+
+# 音訊指紋：從解碼後的 PCM 計算的位元指紋，存在音樂庫索引中，以向量化的漢明距離比對
+# 每個時間段一列 (fingerprint_bands - 1) 位元，需為 8 的倍數，列才能以整數個位元組平移
+# 每段平均 fingerprint_window 個間隔的能量，並與 fingerprint_window 段之後比較；
+# 比對時在 ±fingerprint_max_shift 段（約 3 秒）內平移取最小距離，開頭長度不同的重新上傳也能對齊
+fingerprint_sample_rate = 11025
+fingerprint_seconds = 90
+fingerprint_frame_size = 2048
+fingerprint_segments = 192
+fingerprint_window = 5
+fingerprint_bands = 17
+fingerprint_row_bytes = (fingerprint_bands - 1) // 8
+fingerprint_size = fingerprint_segments * fingerprint_row_bytes
+fingerprint_max_shift = 7
+fingerprint_match_threshold = 0.2
+fingerprint_matrix_cache = None
+
+# 核對音樂庫與試算表：雲端硬碟的檔案操作延遲高，執行緒數多於 CPU 數；時長差距超過容許秒數才算不一致
+reconcile_workers = 16
+reconcile_duration_tolerance = 1
+reconcile_report_limit = 20
+
+class TokenBucket:
+    """令牌桶限速器：以每分鐘請求數補充令牌，允許短暫突發，供所有下載執行緒共用"""
+
+    def __init__(self, requests_per_minute, burst=1):
+        self.lock = threading.Lock()
+        self.set_rate(requests_per_minute, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def set_rate(self, requests_per_minute, burst=None):
+        with self.lock:
+            self.rate = max(requests_per_minute, 0.1) / 60.0
+            if burst is not None:
+                self.capacity = max(1, int(burst))
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class DownloadScheduler:
+    """
+    依 yt-dlp 的失敗類型調整請求速率：遇到 429 或限流時速率減半並以指數退避（含隨機抖動）暫停，
+    連續失敗達門檻時開啟斷路器暫停所有下載；連續成功則逐步調回速率
+    學到的安全速率保存在音樂資料夾中，下次執行時沿用
+    """
+
+    def __init__(self, state_path, requests_per_minute, burst=1):
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.max_rate = requests_per_minute
+        self.rate = requests_per_minute
+        self.consecutive_failures = 0
+        self.success_streak = 0
+        self.paused_until = 0
+        self.bucket = TokenBucket(self.rate, burst)
+
+    def load_state(self):
+        """讀取先前學到的安全速率；音樂資料夾設定完成後才呼叫"""
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.rate = min(self.max_rate, max(min_requests_per_minute, float(state['requests_per_minute'])))
+            self.bucket.set_rate(self.rate)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def save_state(self):
+        try:
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'requests_per_minute': self.rate,
+                    'updated': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }, f)
+        except OSError as e:
+            print(f"保存下載速率設定時發生錯誤: {str(e)}")
+
+    def configure(self, requests_per_minute, burst=None):
+        """設定速率上限；若先前學到的安全速率較低，從安全速率開始"""
+        with self.lock:
+            self.max_rate = requests_per_minute
+            self.rate = min(self.rate, requests_per_minute)
+            self.bucket.set_rate(self.rate, burst)
+        return self.rate
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                wait = self.paused_until - time.time()
+            if wait <= 0:
+                break
+            time.sleep(min(wait, 5))
+        self.bucket.acquire()
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.success_streak += 1
+            if self.success_streak >= rate_increase_after and self.rate < self.max_rate:
+                self.success_streak = 0
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.bucket.set_rate(self.rate)
+                self.save_state()
+
+    def record_failure(self, error_text):
+        """記錄一次失敗並回傳錯誤類型"""
+        kind = classify_ytdlp_error(error_text)
+        if kind not in ("rate_limited", "throttled"):
+            return kind
+
+        with self.lock:
+            self.success_streak = 0
+            self.consecutive_failures += 1
+            self.rate = max(min_requests_per_minute, self.rate / 2)
+            self.bucket.set_rate(self.rate)
+
+            if self.consecutive_failures >= circuit_breaker_threshold:
+                pause = circuit_breaker_cooldown
+                print(f"連續 {self.consecutive_failures} 次被 YouTube 限制，暫停所有下載 {pause // 60} 分鐘")
+            else:
+                pause = min(backoff_max_seconds, backoff_base_seconds * 2 ** (self.consecutive_failures - 1))
+                pause *= random.uniform(0.5, 1.5)
+                print(f"被 YouTube 限制 ({kind})，每分鐘請求數降為 {self.rate:g}，{pause:.0f} 秒後再試")
+            self.paused_until = max(self.paused_until, time.time() + pause)
+            self.save_state()
+        return kind
+
+class BandwidthGovernor:
+    """
+    依每次下載實際量測的吞吐量調整 yt-dlp 的 --limit-rate 與同時下載的片段數 (-N)：
+    吞吐量接近上限表示頻寬還有餘裕，調高一階；遇到 429、限流錯誤或吞吐量異常低落時降一階
+    上限以固定階梯調整，程序內引擎依參數快取，不會因為每次微調而重建
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.level = bandwidth_start_level
+        self.peak_throughput = 0
+        self.last_decrease = 0
+        self.samples = []
+
+    def configure(self, enabled):
+        """啟用時從起始階梯開始調整；停用時不限速並使用最多的片段數"""
+        with self.lock:
+            self.enabled = enabled
+            self.level = bandwidth_start_level if enabled else len(bandwidth_levels) - 1
+            self.samples = []
+
+    def current_limit(self):
+        with self.lock:
+            return bandwidth_levels[self.level]
+
+    def ytdlp_args(self):
+        """回傳 (yt-dlp 參數, 目前階梯)；頻寬較低時只下載單一片段，避免同時發出過多請求"""
+        with self.lock:
+            level = self.level
+        limit = bandwidth_levels[level]
+        fragments = max(1, min(max_concurrent_fragments, level))
+        args = f"--concurrent-fragments {fragments}"
+        if limit:
+            args = f"--limit-rate {limit} {args}"
+        return args, level
+
+    def record_download(self, level, size_bytes, seconds):
+        """記錄一次成功下載的吞吐量並回傳 (位元組/秒)"""
+        if seconds <= 0 or not size_bytes:
+            return 0
+        throughput = size_bytes / seconds
+        with self.lock:
+            self.samples.append(throughput)
+            if not self.enabled or level != self.level:
+                self.peak_throughput = max(self.peak_throughput, throughput)
+                return throughput
+
+            limit = parse_rate_limit(bandwidth_levels[level])
+            reference = limit or self.peak_throughput
+            if size_bytes >= bandwidth_min_sample_bytes and throughput < bandwidth_throttle_ratio * reference:
+                self.decrease("吞吐量異常低落")
+            elif limit and throughput >= bandwidth_saturation_ratio * limit and self.level < len(bandwidth_levels) - 1:
+                self.level += 1
+                self.report_level()
+            self.peak_throughput = max(self.peak_throughput, throughput)
+        return throughput
+
+    def record_failure(self, kind):
+        if kind not in ("rate_limited", "throttled"):
+            return
+        with self.lock:
+            if self.enabled:
+                self.decrease("被 YouTube 限制")
+
+    def decrease(self, reason):
+        # 多個下載同時遇到限制時只降一階，需呼叫端持有 lock
+        now = time.time()
+        if self.level == 0 or now - self.last_decrease < bandwidth_decrease_cooldown:
+            return
+        self.level -= 1
+        self.last_decrease = now
+        self.report_level(reason)
+
+    def report_level(self, reason=""):
+        limit = bandwidth_levels[self.level]
+        fragments = max(1, min(max_concurrent_fragments, self.level))
+        prefix = f"{reason}，" if reason else ""
+        print(f"{prefix}每個下載的頻寬上限調整為 {limit or '不限速'}，同時下載片段數 {fragments}")
+
+    def print_summary(self):
+        with self.lock:
+            samples = sorted(self.samples)
+            limit = bandwidth_levels[self.level]
+        if samples:
+            print(f"下載吞吐量：中位數 {percentile(samples, 50) / 1048576:.2f} MB/s，"
+                  f"最高 {samples[-1] / 1048576:.2f} MB/s（目前上限 {limit or '不限速'}）")
+
+def parse_rate_limit(text):
+    """將 yt-dlp 的速率字串（如 512K、2M）轉為每秒位元組數；None 表示不限速"""
+    if not text:
+        return None
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    return float(text[:-1]) * units[text[-1].upper()] if text[-1].upper() in units else float(text)
+
+def classify_ytdlp_error(error_text):
+    """將 yt-dlp 的錯誤訊息分類為 rate_limited、throttled、unavailable、geo_blocked 或 other"""
+    text = (error_text or "").lower()
+    if "429" in text or "too many requests" in text or "confirm you're not a bot" in text:
+        return "rate_limited"
+    if "available in your country" in text or "geo restrict" in text or "geo-restrict" in text:
+        return "geo_blocked"
+    if ("video unavailable" in text or "private video" in text or "has been removed" in text
+            or "is not available" in text or "account associated with this video has been terminated" in text):
+        return "unavailable"
+    if "403" in text or "throttl" in text or "timed out" in text or "connection reset" in text:
+        return "throttled"
+    return "other"
+
+default_requests_per_minute = 20
+default_burst = 3
+default_download_workers = 3
+min_requests_per_minute = 1
+rate_increase_after = 5
+backoff_base_seconds = 30
+backoff_max_seconds = 600
+circuit_breaker_threshold = 3
+circuit_breaker_cooldown = 15 * 60
+max_download_attempts = 3
+
+# 頻寬調節：每個下載的 --limit-rate 在以下階梯間調整，None 表示不限速
+bandwidth_levels = ["512K", "1M", "2M", "4M", "8M", None]
+bandwidth_start_level = 2
+# 吞吐量達到上限的這個比例時調高一階；低於參考值的這個比例（且檔案夠大）視為被限速
+bandwidth_saturation_ratio = 0.8
+bandwidth_throttle_ratio = 0.2
+bandwidth_min_sample_bytes = 1024 * 1024
+bandwidth_decrease_cooldown = 30
+max_concurrent_fragments = 4
+
+# 記錄目前執行緒最近一次下載失敗的原因，供批次日誌使用
+download_status = threading.local()
+
+# 批次下載日誌：每個批次一個只追加的 JSONL 檔，存在雲端硬碟上，執行階段重置後可從中斷處繼續
+batch_journal_dir = os.path.join(base_output_dir, "batch_jobs")
+batch_journal_lock = threading.Lock()
+
+download_scheduler = DownloadScheduler(
+    os.path.join(base_output_dir, "download_scheduler.json"),
+    default_requests_per_minute,
+    default_burst
+)
+bandwidth_governor = BandwidthGovernor()
+bandwidth_governor.configure(False)
+
+# 試算表 API 請求預算：Sheets API 每位使用者每分鐘讀取與寫入各 60 次，保留一點餘裕
+# 所有試算表請求都經過 sheets_request()，超出配額 (429) 或暫時性錯誤時以指數退避重試
+sheets_requests_per_minute = 55
+sheets_request_burst = 5
+sheets_max_attempts = 6
+sheets_backoff_max_seconds = 64
+sheet_read_budget = TokenBucket(sheets_requests_per_minute, sheets_request_burst)
+sheet_write_budget = TokenBucket(sheets_requests_per_minute, sheets_request_burst)
+sheet_request_counts = {"read": 0, "write": 0}
+sheet_request_lock = threading.Lock()
+
+# 下載完成後的互動提示與試算表寫入在多執行緒下必須逐一進行
+interaction_lock = threading.Lock()
+
+# 各階段耗時：每個階段結束時記錄一筆 (網址, 類別, 階段, 秒數)，批次中同時寫入本機的 JSONL 檔
+# timing_context.item 是目前執行緒正在處理的項目；背景搬移等跨執行緒的階段會明確傳入項目
+timing_context = threading.local()
+timing_records = []
+timing_lock = threading.Lock()
+timing_log_file = None
+
+# 無人值守時各提示的固定回答：設定後對應的提示不再等待輸入
+prompt_policies = {}
+
+# 下載與轉檔先在本機暫存區進行，完成後由背景執行緒搬移到雲端硬碟的分類資料夾
+staging_dir = "/content/staging"
+file_move_workers = 2
+file_move_attempts = 3
+file_mover = None
+pending_moves = {}
+pending_moves_lock = threading.Lock()
+
+# 下載與 MP3 轉檔分開：下載執行緒只抓原始音訊串流，轉檔與寫入標籤交給依 CPU 數量建立的轉檔執行緒池
+# （編碼在 ffmpeg 子程序中進行，執行緒只負責啟動與等待，不需要另開 Python 程序）
+transcode_workers = os.cpu_count() or 2
+# 輸出格式策略：
+#   "mp3"               一律重新編碼為 MP3
+#   "mp3_if_source_mp3" 輸出 MP3，來源已是 MP3 時直接複製音訊串流，其餘才重新編碼
+#   "native"            保留來源編碼 (m4a/opus/ogg/mp3)，只以串流複製換成純音訊容器，不重新編碼
+audio_format_policies = ("mp3", "mp3_if_source_mp3", "native")
+audio_format_policy = "mp3_if_source_mp3"
+audio_extensions = ('.mp3', '.m4a', '.opus', '.ogg')
+
+# 元數據快取：以 (路徑, 大小, 修改時間) 為鍵，檔案內容變動後自然失效
+metadata_cache_size = 4096
+# MP3 只讀取 ID3v2 中需要的文字框架與第一個音訊框架附近的資料
+mp3_header_probe_size = 4096
+id3_text_frames = {
+    'TIT2': 'title', 'TPE1': 'artist', 'TALB': 'album',
+    'TT2': 'title', 'TP1': 'artist', 'TAL': 'album'
+}
+mp3_bitrates = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+transcode_pool = None
+transcode_pool_lock = threading.Lock()
+
+# 已擁有的 YouTube 影片 ID：下載前先比對，已下載過的影片不必再下載與轉檔
+owned_ids_path = os.path.join(base_output_dir, "downloaded_ids.txt")
+owned_video_ids = None
+owned_ids_lock = threading.Lock()
+
+# 搜尋結果快取：以正規化後的搜尋字詞為鍵，過期或超過數量上限的項目會被淘汰
+search_cache_path = os.path.join(cache_dir, "search_cache.json")
+search_cache_ttl = 6 * 60 * 60
+search_cache_max_entries = 200
+search_cache = None
+search_cache_lock = threading.Lock()
+search_result_count = 10
+
+# 批次搜尋歌名：同時搜尋的數量（仍受下載排程器的速率限制），以及自動採用最佳結果的信心門檻；
+# 低於門檻的歌名留待手動確認
+search_workers = 4
+search_confidence_threshold = 0.6
+# 標題含有這些字詞但歌名沒有時，通常不是原曲
+search_noise_words = ("live", "cover", "remix", "karaoke", "instrumental", "reaction", "nightcore",
+                      "sped up", "slowed", "1 hour", "翻唱", "伴奏", "現場", "カバー")
+search_filler_words = {"official", "music", "video", "audio", "mv", "lyrics", "lyric", "hd", "4k", "官方", "完整版"}
+
+# 優先在程序內直接使用 yt_dlp 模組，避免每次操作都重新啟動 yt-dlp 子程序
+use_inprocess_ytdlp = True
+ytdlp_engines = threading.local()
+# 未處理的擷取結果可能只是轉址（如 youtu.be/ID?list=... 指向播放清單），最多跟隨的次數
+max_ytdlp_url_redirects = 3
+
+def record_stage(stage, seconds, item=None):
+    if item is None:
+        item = getattr(timing_context, "item", None) or {}
+    record = {
+        "url": item.get("url", ""),
+        "category": item.get("category"),
+        "stage": stage,
+        "seconds": round(seconds, 4),
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    with timing_lock:
+        timing_records.append(record)
+        if timing_log_file:
+            timing_log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+@contextmanager
+def timed_stage(stage, item=None):
+    """記錄 with 區塊的耗時"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, item)
+
+def start_timing_log(name):
+    """清空先前的紀錄並開始寫入新的耗時日誌，回傳日誌路徑"""
+    global timing_log_file
+    log_path = os.path.join(cache_dir, "timings", f"{name}.jsonl")
+    with timing_lock:
+        timing_records.clear()
+        try:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            timing_log_file = open(log_path, 'a', encoding='utf-8')
+        except OSError as e:
+            print(f"建立耗時日誌時發生錯誤: {str(e)}")
+            timing_log_file = None
+            log_path = None
+    return log_path
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def print_timing_summary():
+    """關閉耗時日誌並列出每個階段的次數、p50、p95 與總耗時"""
+    global timing_log_file
+    with timing_lock:
+        records = timing_records[:]
+        if timing_log_file:
+            timing_log_file.close()
+            timing_log_file = None
+    if not records:
+        return
+
+    stages = {}
+    items = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record["seconds"])
+        if record["url"]:
+            items[record["url"]] = items.get(record["url"], 0) + record["seconds"]
+
+    print("\n=== 各階段耗時 (秒) ===")
+    print(f"{'階段':<20}{'次數':>6}{'p50':>9}{'p95':>9}{'總計':>10}")
+    for stage, values in sorted(stages.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        print(f"{stage:<22}{len(values):>6}{percentile(values, 50):>9.2f}{percentile(values, 95):>9.2f}{sum(values):>10.2f}")
+    if items:
+        totals = sorted(items.values())
+        print(f"{'每首歌合計':<17}{len(totals):>6}{percentile(totals, 50):>9.2f}{percentile(totals, 95):>9.2f}{sum(totals):>10.2f}")
+    with sheet_request_lock:
+        print(f"試算表 API 請求：讀取 {sheet_request_counts['read']} 次，寫入 {sheet_request_counts['write']} 次"
+              f"（預算每分鐘各 {sheets_requests_per_minute} 次）")
 
 def get_file_size(file_path):
     try:
@@ -53,30 +535,203 @@ def get_file_size(file_path):
         print(f"獲取檔案大小 {os.path.basename(file_path)} 時發生錯誤: {str(e)}")
         return "未知大小"
 
-def get_mp3_metadata(file_path):
-    try:
-        audio = MP3(file_path)
-        try:
-            tags = ID3(file_path)
-            title = str(tags.get('TIT2', '未知標題')).replace('TIT2(text=["', '').replace('"])', '')
-            artist = str(tags.get('TPE1', '未知藝人')).replace('TPE1(text=["', '').replace('"])', '')
-            album = str(tags.get('TALB', '未知專輯')).replace('TALB(text=["', '').replace('"])', '')
-        except:
-            title = os.path.basename(file_path).replace('.mp3', '')
-            artist = '未知藝人'
-            album = '未知專輯'
+def decode_id3_text(data):
+    """解碼 ID3 文字框架內容，只取第一個值"""
+    if not data:
+        return None
+    encoding = data[0]
+    raw = data[1:]
+    if encoding == 0:
+        text = raw.decode('latin-1', errors='replace')
+    elif encoding == 1:
+        text = raw.decode('utf-16', errors='replace')
+    elif encoding == 2:
+        text = raw.decode('utf-16-be', errors='replace')
+    else:
+        text = raw.decode('utf-8', errors='replace')
+    text = text.split('\x00')[0].strip()
+    return text or None
+
+def read_id3v2_tags(f):
+    """
+    從檔頭讀取 ID3v2 標籤中的標題、演出者與專輯，其餘框架（例如封面圖片）直接跳過不讀取
+    回傳 (標籤字典, 音訊資料起始位置)；標籤使用不同步化時回傳 None 交由 mutagen 處理
+    """
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return {}, 0
+
+    major = header[3]
+    flags = header[5]
+    tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    tag_end = 10 + tag_size + (10 if flags & 0x10 else 0)
+    if flags & 0x80 or major not in (2, 3, 4):
+        return None
+
+    position = 10
+    if flags & 0x40 and major in (3, 4):
+        extended = f.read(4)
+        if major == 4:
+            extended_size = (extended[0] << 21) | (extended[1] << 14) | (extended[2] << 7) | extended[3]
+        else:
+            extended_size = struct.unpack('>I', extended)[0] + 4
+        position += extended_size
+        f.seek(position)
+
+    header_size = 6 if major == 2 else 10
+    tags = {}
+    while position + header_size <= 10 + tag_size and len(tags) < 3:
+        frame_header = f.read(header_size)
+        if len(frame_header) < header_size or frame_header[0] == 0:
+            break
+        if major == 2:
+            frame_id = frame_header[:3].decode('latin-1')
+            frame_size = int.from_bytes(frame_header[3:6], 'big')
+            frame_flags = 0
+        else:
+            frame_id = frame_header[:4].decode('latin-1')
+            size_bytes = frame_header[4:8]
+            if major == 4:
+                frame_size = (size_bytes[0] << 21) | (size_bytes[1] << 14) | (size_bytes[2] << 7) | size_bytes[3]
+            else:
+                frame_size = struct.unpack('>I', size_bytes)[0]
+            frame_flags = struct.unpack('>H', frame_header[8:10])[0]
+
+        position += header_size
+        key = id3_text_frames.get(frame_id)
+        # 壓縮、加密或不同步化的框架不做處理
+        if key and key not in tags and not frame_flags & 0x00CF:
+            value = decode_id3_text(f.read(frame_size))
+            if value:
+                tags[key] = value
+        position += frame_size
+        f.seek(position)
+
+    return tags, tag_end
+
+def parse_mp3_frame_header(data, offset):
+    """解析 MPEG 音訊框架標頭，回傳 (版本, 層, 位元率 kbps, 取樣率, 聲道模式)；不是有效標頭時回傳 None"""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (data[offset + 1] >> 3) & 0x03
+    layer_bits = (data[offset + 1] >> 1) & 0x03
+    bitrate_index = data[offset + 2] >> 4
+    sample_rate_index = (data[offset + 2] >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    version = {3: 1, 2: 2, 0: 2.5}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = mp3_bitrates[(1 if version == 1 else 2, layer)][bitrate_index]
+    sample_rate = [44100, 48000, 32000][sample_rate_index]
+    if version == 2:
+        sample_rate //= 2
+    elif version == 2.5:
+        sample_rate //= 4
+    channel_mode = data[offset + 3] >> 6
+    return version, layer, bitrate, sample_rate, channel_mode
+
+def read_mp3_duration(f, audio_start, file_size):
+    """讀取第一個音訊框架的 Xing/Info 或 VBRI 標頭取得總框架數計算時長，沒有時依位元率估算 (CBR)"""
+    f.seek(audio_start)
+    data = f.read(mp3_header_probe_size)
+    for offset in range(len(data) - 4):
+        frame = parse_mp3_frame_header(data, offset)
+        if frame:
+            break
+    else:
+        return None
+
+    version, layer, bitrate, sample_rate, channel_mode = frame
+    if layer == 1:
+        samples_per_frame = 384
+    elif layer == 3 and version != 1:
+        samples_per_frame = 576
+    else:
+        samples_per_frame = 1152
 
+    mono = channel_mode == 3
+    if version == 1:
+        side_info_size = 17 if mono else 32
+    else:
+        side_info_size = 9 if mono else 17
+
+    xing_offset = offset + 4 + side_info_size
+    if data[xing_offset:xing_offset + 4] in (b'Xing', b'Info'):
+        xing_flags = struct.unpack('>I', data[xing_offset + 4:xing_offset + 8])[0]
+        if xing_flags & 0x01:
+            frame_count = struct.unpack('>I', data[xing_offset + 8:xing_offset + 12])[0]
+            return frame_count * samples_per_frame / sample_rate
+
+    vbri_offset = offset + 4 + 32
+    if data[vbri_offset:vbri_offset + 4] == b'VBRI':
+        frame_count = struct.unpack('>I', data[vbri_offset + 14:vbri_offset + 18])[0]
+        return frame_count * samples_per_frame / sample_rate
+
+    audio_size = file_size - audio_start - offset
+    # 檔尾的 ID3v1 標籤固定 128 位元組；比它還小的檔案不可能有，也不能往回定位
+    if file_size >= 128:
+        f.seek(-128, os.SEEK_END)
+        if f.read(3) == b'TAG':
+            audio_size -= 128
+    return audio_size * 8 / (bitrate * 1000)
+
+def read_mp3_metadata(file_path, file_size):
+    """只讀取 MP3 檔頭區域取得標籤與時長；格式不支援時回傳 None"""
+    with open(file_path, 'rb') as f:
+        result = read_id3v2_tags(f)
+        if result is None:
+            return None
+        tags, audio_start = result
+        duration = read_mp3_duration(f, audio_start, file_size)
+    if duration is None:
+        return None
+    return tags, duration
+
+@lru_cache(maxsize=metadata_cache_size)
+def read_audio_metadata(file_path, file_size, mtime):
+    """實際讀取元數據；file_size 與 mtime 作為快取鍵的一部分，檔案變動後會重新讀取"""
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    parsed = None
+    if file_path.lower().endswith('.mp3'):
+        parsed = read_mp3_metadata(file_path, file_size)
+
+    if parsed:
+        tags, duration = parsed
+    else:
+        import mutagen
+        audio = mutagen.File(file_path, easy=True)
+        if audio is None:
+            raise ValueError("不支援的音訊格式")
+        tags = {}
+        for key in ('title', 'artist', 'album'):
+            values = (audio.tags or {}).get(key) or []
+            if values:
+                tags[key] = str(values[0])
         duration = audio.info.length
+
+    return (
+        tags.get('title') or base_name,
+        tags.get('artist') or '未知藝人',
+        tags.get('album') or '未知專輯',
+        format_duration_seconds(duration)
+    )
+
+def get_audio_metadata(file_path):
+    """讀取音訊檔的標題、演出者、專輯與時長，支援 MP3、M4A、Opus 與 Ogg；同一檔案重複查詢時直接使用快取"""
+    try:
+        stat = os.stat(file_path)
+        title, artist, album, duration = read_audio_metadata(file_path, stat.st_size, stat.st_mtime)
         return {
-            'title': title if title != '未知標題' else os.path.basename(file_path).replace('.mp3', ''),
+            'title': title,
             'artist': artist,
             'album': album,
-            'duration': format_duration_seconds(duration)
+            'duration': duration
         }
     except Exception as e:
-        print(f"讀取MP3檔案 {os.path.basename(file_path)} 元數據時發生錯誤: {str(e)}")
+        print(f"讀取音訊檔案 {os.path.basename(file_path)} 元數據時發生錯誤: {str(e)}")
         return {
-            'title': os.path.basename(file_path).replace('.mp3', ''),
+            'title': os.path.splitext(os.path.basename(file_path))[0],
             'artist': '未知藝人',
             'album': '未知專輯',
             'duration': '未知時長'
@@ -96,10 +751,49 @@ def format_duration_seconds(seconds):
     except ValueError:
         return "格式錯誤"
 
+def running_in_colab():
+    return "google.colab" in sys.modules
+
+def configure_storage(music_root=None):
+    """
+    設定音樂資料夾與衍生路徑並建立所需資料夾
+    未指定時，在 Colab 中掛載雲端硬碟，其他環境使用 YT_MP3_MUSIC_DIR 或 ~/Music/MUSIC
+    """
+    global base_output_dir, cache_dir, staging_dir, library_index_path, owned_ids_path
+    global batch_journal_dir, search_cache_path
+
+    if running_in_colab():
+        if music_root is None:
+            from google.colab import drive
+            drive.mount('/content/drive', force_remount=True)
+            music_root = colab_music_root
+    else:
+        music_root = music_root or os.environ.get("YT_MP3_MUSIC_DIR") or local_music_root
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "yt-mp3")
+        staging_dir = os.path.join(tempfile.gettempdir(), "yt-mp3-staging")
+
+    base_output_dir = music_root
+    for category in category_folders:
+        category_folders[category] = os.path.join(base_output_dir, category)
+    library_index_path = os.path.join(base_output_dir, "library_index.sqlite")
+    owned_ids_path = os.path.join(base_output_dir, "downloaded_ids.txt")
+    batch_journal_dir = os.path.join(base_output_dir, "batch_jobs")
+    search_cache_path = os.path.join(cache_dir, "search_cache.json")
+
+    for folder_path in [base_output_dir, cache_dir, staging_dir] + list(category_folders.values()):
+        os.makedirs(folder_path, exist_ok=True)
+
+    download_scheduler.state_path = os.path.join(base_output_dir, "download_scheduler.json")
+    download_scheduler.load_state()
+
 def initialize_google_sheet():
     global gc, spreadsheet, worksheet, spreadsheet_name
     try:
-        auth.authenticate_user()
+        import gspread
+        from google.auth import default
+        if running_in_colab():
+            from google.colab import auth
+            auth.authenticate_user()
         creds, _ = default()
         gc = gspread.authorize(creds)
 
@@ -111,22 +805,23 @@ def initialize_google_sheet():
             print(f"找不到試算表 '{spreadsheet_name}'，已自動創建新的試算表。")
 
         required_sheets = ["下載記錄", "中文歌", "日文歌", "英文歌", "純音樂"]
-        existing_sheets = [ws.title for ws in spreadsheet.worksheets()]
+        existing_sheets = {ws.title: ws for ws in sheets_request("read", spreadsheet.worksheets)}
 
         for sheet_name in required_sheets:
             if sheet_name not in existing_sheets:
-                spreadsheet.add_worksheet(title=sheet_name, rows=1, cols=10)
+                existing_sheets[sheet_name] = sheets_request(
+                    "write", spreadsheet.add_worksheet, title=sheet_name, rows=1, cols=10
+                )
                 print(f"創建了新工作表: {sheet_name}")
 
-            ws = spreadsheet.worksheet(sheet_name)
+            ws = existing_sheets[sheet_name]
+            sheet_ids[sheet_name] = ws.id
             current_headers = []
             if ws.row_count > 0:
-                current_headers = ws.row_values(1)
+                current_headers = sheets_request("read", ws.row_values, 1)
  
-            expected_headers = ["序號", "日期時間", "檔案名稱", "YouTube網址", "歌曲標題", "藝術家", "專輯", "時長", "文件大小", "類別"]
-
-            if not current_headers or current_headers != expected_headers:
-                ws.update('A1', [expected_headers], value_input_option='USER_ENTERED')
+            if not current_headers or current_headers != sheet_headers:
+                sheets_request("write", ws.update, 'A1', [sheet_headers], value_input_option='USER_ENTERED')
                 print(f"已在工作表 '{sheet_name}' 中設定/更新標題行。")
 
                 requests = []
@@ -174,14 +869,17 @@ def initialize_google_sheet():
 
                 if requests:
                     try:
-                        spreadsheet.batch_update({"requests": requests})
+                        sheets_request("write", spreadsheet.batch_update, {"requests": requests})
                         print(f"已調整工作表 '{sheet_name}' 的欄位寬度並設置所有欄位靠左對齊。")
                     except Exception as e_width:
                         print(f"調整工作表 '{sheet_name}' 欄位格式時發生錯誤: {e_width}")
 
-        worksheet = spreadsheet.worksheet("下載記錄")
+        worksheet = existing_sheets["下載記錄"]
         print("預設使用「下載記錄」工作表")
 
+        with sheet_write_lock:
+            sheet_mirrors.clear()
+
         return True
 
     except Exception as e:
@@ -189,6 +887,26 @@ def initialize_google_sheet():
         gc = spreadsheet = worksheet = None
         return False
 
+def ask(prompt, policy=None):
+    """讀取使用者輸入；prompt_policies 中有對應的策略時直接採用策略的回答"""
+    if policy and policy in prompt_policies:
+        answer = prompt_policies[policy]
+        print(f"{prompt}{answer}（依設定自動回答）")
+        return answer
+    return input(prompt)
+
+def parse_category(text):
+    """將類別名稱或編號 (0-4) 轉為類別，無法辨識時拋出 ValueError"""
+    text = (text or "").strip()
+    names = list(category_folders)
+    if text in ("", "0", "none", "不分類"):
+        return None
+    if text in names:
+        return text
+    if text.isdigit() and 1 <= int(text) <= len(names):
+        return names[int(text) - 1]
+    raise ValueError(f"未知的類別: {text}")
+
 def select_song_category():
     """讓用戶選擇歌曲的類別"""
     print("\n請選擇歌曲類別:")
@@ -213,6 +931,55 @@ def select_song_category():
         else:
             print("無效的選擇，請重新輸入。")
 
+def extract_video_id(url):
+    """從各種 YouTube 網址格式取出 11 碼影片 ID，無法辨識時回傳 None"""
+    match = re.search(r'(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([0-9A-Za-z_-]{11})', url or "")
+    return match.group(1) if match else None
+
+def load_owned_video_ids():
+    """載入已擁有的影片 ID：本地檔案加上試算表「YouTube網址」欄位，只在第一次使用時讀取"""
+    global owned_video_ids
+    if owned_video_ids is None:
+        ids = set()
+        try:
+            with open(owned_ids_path, 'r', encoding='utf-8') as f:
+                ids.update(line.strip() for line in f if line.strip())
+        except OSError:
+            pass
+
+        if spreadsheet:
+            try:
+                with sheet_write_lock:
+                    urls = list(get_sheet_mirror("下載記錄")["by_url"])
+                ids.update(video_id for video_id in map(extract_video_id, urls) if video_id)
+            except Exception as e:
+                print(f"從試算表讀取已下載影片時發生錯誤: {str(e)}")
+
+        owned_video_ids = ids
+    return owned_video_ids
+
+def is_video_owned(url):
+    video_id = extract_video_id(url)
+    if not video_id:
+        return False
+    with owned_ids_lock:
+        return video_id in load_owned_video_ids()
+
+def mark_video_owned(url):
+    video_id = extract_video_id(url)
+    if not video_id:
+        return
+    with owned_ids_lock:
+        ids = load_owned_video_ids()
+        if video_id in ids:
+            return
+        ids.add(video_id)
+        try:
+            with open(owned_ids_path, 'a', encoding='utf-8') as f:
+                f.write(video_id + "\n")
+        except OSError as e:
+            print(f"保存已下載影片 ID 時發生錯誤: {str(e)}")
+
 def get_output_directory(category):
     """根據類別返回對應的輸出目錄"""
     if category and category in category_folders:
@@ -220,6 +987,269 @@ def get_output_directory(category):
     else:
         return base_output_dir
 
+def build_record_values(filename, youtube_url, file_path=None, metadata=None, category=None):
+    """組出記錄中「日期時間」到「類別」欄位的值"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    file_size_str = "N/A"
+    if file_path and os.path.exists(file_path):
+        file_size_str = get_file_size(file_path)
+
+    title = artist = album = duration_str = "未知"
+    if metadata:
+        title = metadata.get('title', '未知標題')
+        artist = metadata.get('artist', '未知藝人')
+        album = metadata.get('album', '未知專輯')
+        duration_str = metadata.get('duration', '未知時長')
+    elif file_path and os.path.exists(file_path) and filename.lower().endswith(audio_extensions):
+        temp_metadata = get_audio_metadata(file_path)
+        if temp_metadata:
+            title = temp_metadata.get('title', '未知標題')
+            artist = temp_metadata.get('artist', '未知藝人')
+            album = temp_metadata.get('album', '未知專輯')
+            duration_str = temp_metadata.get('duration', '未知時長')
+
+    return [
+        now,
+        filename,
+        youtube_url,
+        title,
+        artist,
+        album,
+        duration_str,
+        file_size_str,
+        category if category else "未分類"
+    ]
+
+def load_sheet_mirror(sheet_name):
+    """讀取整個工作表並建立檔案名稱與網址索引"""
+    with timed_stage("sheet_read"):
+        ws = sheets_request("read", spreadsheet.worksheet, sheet_name)
+        sheet_ids[sheet_name] = ws.id
+        rows = sheets_request("read", ws.get_all_values)
+    if not rows:
+        sheets_request("write", ws.update, 'A1', [sheet_headers], value_input_option='USER_ENTERED')
+        print(f"偵測到工作表「{sheet_name}」為空或標題行遺失，已自動補上標題行。")
+        rows = [list(sheet_headers)]
+
+    headers = rows[0] if rows[0] and rows[0][0] == "序號" else sheet_headers
+    mirror = {
+        "rows": rows,
+        "headers": headers,
+        "filename_idx": headers.index("檔案名稱") if "檔案名稱" in headers else 2,
+        "url_idx": headers.index("YouTube網址") if "YouTube網址" in headers else 3,
+        "by_filename": {},
+        "by_url": {}
+    }
+    for row_index in range(2, len(rows) + 1):
+        index_mirror_row(mirror, row_index)
+    return mirror
+
+def index_mirror_row(mirror, row_index):
+    row = mirror["rows"][row_index - 1]
+    for key, idx in (("by_filename", mirror["filename_idx"]), ("by_url", mirror["url_idx"])):
+        if idx < len(row) and row[idx]:
+            rows_for_value = mirror[key].setdefault(row[idx], [])
+            if row_index not in rows_for_value:
+                rows_for_value.append(row_index)
+
+def unindex_mirror_row(mirror, row_index):
+    row = mirror["rows"][row_index - 1]
+    for key, idx in (("by_filename", mirror["filename_idx"]), ("by_url", mirror["url_idx"])):
+        if idx < len(row) and row[idx] in mirror[key]:
+            rows_for_value = mirror[key][row[idx]]
+            if row_index in rows_for_value:
+                rows_for_value.remove(row_index)
+            if not rows_for_value:
+                del mirror[key][row[idx]]
+
+def get_sheet_mirror(sheet_name):
+    if sheet_name not in sheet_mirrors:
+        sheet_mirrors[sheet_name] = load_sheet_mirror(sheet_name)
+    return sheet_mirrors[sheet_name]
+
+def refresh_sheet_mirrors(sheet_names=None):
+    """先寫出佇列中的記錄，再重新載入工作表鏡像（用於試算表被外部修改後）"""
+    flush_sheet_writes()
+    with sheet_write_lock:
+        for sheet_name in (sheet_names or list(sheet_mirrors)):
+            sheet_mirrors.pop(sheet_name, None)
+
+def find_sheet_rows(sheet_name, filename=None, youtube_url=None):
+    """以鏡像索引查詢符合檔案名稱或網址的 (列號, 列內容)"""
+    with sheet_write_lock:
+        mirror = get_sheet_mirror(sheet_name)
+        if filename is not None:
+            row_indexes = mirror["by_filename"].get(filename, [])
+        else:
+            row_indexes = mirror["by_url"].get(youtube_url, [])
+        return [(row_index, list(mirror["rows"][row_index - 1])) for row_index in sorted(row_indexes)]
+
+def queue_sheet_append(sheet_name, values):
+    """將新記錄排入寫入佇列，回傳該記錄預計所在的列號"""
+    with sheet_write_lock:
+        mirror = get_sheet_mirror(sheet_name)
+        row_index = len(mirror["rows"]) + 1
+        row = [str(row_index - 1)] + list(values)
+        mirror["rows"].append(row)
+        index_mirror_row(mirror, row_index)
+        sheet_write_queue.append({
+            "type": "append",
+            "sheet": sheet_name,
+            "row_index": row_index,
+            "values": list(row)
+        })
+        pending = len(sheet_write_queue)
+    start_sheet_writer(pending)
+    return row_index
+
+def queue_sheet_update(sheet_name, row_index, values):
+    """將既有記錄的更新排入寫入佇列；若該列仍在佇列中尚未寫出，直接合併到原本的寫入"""
+    with sheet_write_lock:
+        mirror = get_sheet_mirror(sheet_name)
+        if row_index <= len(mirror["rows"]):
+            unindex_mirror_row(mirror, row_index)
+            row = mirror["rows"][row_index - 1]
+            mirror["rows"][row_index - 1] = (row[:1] or [str(row_index - 1)]) + list(values)
+            index_mirror_row(mirror, row_index)
+
+        for op in sheet_write_queue:
+            if op["sheet"] == sheet_name and op["row_index"] == row_index:
+                op["values"][-len(values):] = list(values)
+                return
+        sheet_write_queue.append({
+            "type": "update",
+            "sheet": sheet_name,
+            "row_index": row_index,
+            "values": list(values)
+        })
+        pending = len(sheet_write_queue)
+    start_sheet_writer(pending)
+
+def start_sheet_writer(pending=0):
+    global sheet_writer_thread
+    if sheet_writer_thread is None or not sheet_writer_thread.is_alive():
+        sheet_writer_thread = threading.Thread(target=sheet_writer_loop, daemon=True)
+        sheet_writer_thread.start()
+    if pending >= sheet_flush_batch_size:
+        sheet_write_event.set()
+
+def sheet_writer_loop():
+    while True:
+        sheet_write_event.wait(sheet_flush_interval)
+        sheet_write_event.clear()
+        flush_sheet_writes()
+
+def is_retryable_sheets_error(error):
+    """超出配額 (429) 與伺服器暫時性錯誤 (5xx) 可以重試"""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status in (429, 500, 502, 503, 504):
+        return True
+    text = str(error)
+    return "RATE_LIMIT_EXCEEDED" in text or "Quota exceeded" in text or "[429]" in text
+
+def sheets_request(kind, function, *args, **kwargs):
+    """
+    送出一個試算表 API 請求：先從讀取或寫入的每分鐘預算取得額度，
+    遇到配額或暫時性錯誤時以指數退避（含隨機抖動）重試，其他錯誤直接拋出
+    """
+    budget = sheet_read_budget if kind == "read" else sheet_write_budget
+    for attempt in range(1, sheets_max_attempts + 1):
+        budget.acquire()
+        with sheet_request_lock:
+            sheet_request_counts[kind] += 1
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable_sheets_error(e) or attempt == sheets_max_attempts:
+                raise
+            wait = min(sheets_backoff_max_seconds, 2 ** attempt + random.uniform(0, 1))
+            print(f"試算表 API 超出配額或暫時無法使用，{wait:.0f} 秒後重試 ({attempt}/{sheets_max_attempts})")
+            time.sleep(wait)
+
+def get_sheet_id(sheet_name):
+    if sheet_name not in sheet_ids:
+        sheet_ids[sheet_name] = sheets_request("read", spreadsheet.worksheet, sheet_name).id
+    return sheet_ids[sheet_name]
+
+def build_sheet_cell(value):
+    """
+    將值轉為 CellData 並設為靠左對齊；數字與公式保留原型態，其餘一律為文字
+    （與 USER_ENTERED 不同，日期與時長會保持寫入時的文字，不會被轉成日期時間）
+    """
+    text = str(value)
+    if re.fullmatch(r"-?\d+(\.\d+)?", text):
+        entered = {"numberValue": float(text) if "." in text else int(text)}
+    elif text.startswith("="):
+        entered = {"formulaValue": text}
+    else:
+        entered = {"stringValue": text}
+    return {"userEnteredValue": entered, "userEnteredFormat": {"horizontalAlignment": "LEFT"}}
+
+def flush_sheet_writes():
+    """
+    將佇列中的記錄一次寫出：新增 (appendCells) 與更新 (updateCells) 連同靠左對齊格式
+    合併為單一 batch_update，每次寫出只用一個寫入請求
+    寫出彼此排隊進行：背景寫出正在送出時，結束前的寫出會等它完成（或失敗放回佇列）後再處理剩餘的記錄
+    """
+    with sheet_flush_lock:
+        with sheet_write_lock:
+            if not spreadsheet:
+                # 記錄留在佇列中，試算表重新連線後的下一次寫出仍會送出
+                if sheet_write_queue:
+                    print(f"Google Sheet 尚未初始化。{len(sheet_write_queue)} 筆記錄保留在佇列中，尚未寫入。")
+                return not sheet_write_queue
+            ops = sheet_write_queue[:]
+            sheet_write_queue.clear()
+
+        if not ops:
+            return True
+
+        cell_fields = "userEnteredValue,userEnteredFormat.horizontalAlignment"
+        appends = {}
+        requests = []
+        try:
+            for op in ops:
+                if op["type"] == "append":
+                    appends.setdefault(op["sheet"], []).append(op)
+                else:
+                    row_index = op["row_index"]
+                    requests.append({
+                        "updateCells": {
+                            "range": {
+                                "sheetId": get_sheet_id(op["sheet"]),
+                                "startRowIndex": row_index - 1,
+                                "endRowIndex": row_index,
+                                "startColumnIndex": 1,
+                                "endColumnIndex": 1 + len(op["values"])
+                            },
+                            "rows": [{"values": [build_sheet_cell(value) for value in op["values"]]}],
+                            "fields": cell_fields
+                        }
+                    })
+
+            for sheet_name, sheet_ops in appends.items():
+                sheet_ops.sort(key=lambda op: op["row_index"])
+                requests.insert(0, {
+                    "appendCells": {
+                        "sheetId": get_sheet_id(sheet_name),
+                        "rows": [{"values": [build_sheet_cell(value) for value in op["values"]]} for op in sheet_ops],
+                        "fields": cell_fields
+                    }
+                })
+
+            with timed_stage("sheet_write", {}):
+                sheets_request("write", spreadsheet.batch_update, {"requests": requests})
+        except Exception as e:
+            print(f"批次寫入 Google Sheet 時發生錯誤: {str(e)}，將於下次重試")
+            with sheet_write_lock:
+                sheet_write_queue[:0] = ops
+            return False
+
+        print(f"已批次寫入 {len(ops)} 筆記錄至 Google Sheet")
+        return True
+
+atexit.register(flush_sheet_writes)
+
 def add_record_to_google_sheet(filename, youtube_url, file_path=None, metadata=None, category=None):
     global worksheet, spreadsheet
     if not spreadsheet:
@@ -227,111 +1257,19 @@ def add_record_to_google_sheet(filename, youtube_url, file_path=None, metadata=N
         return False
 
     try:
-        main_worksheet = spreadsheet.worksheet("下載記錄")
-        all_values = main_worksheet.get_all_values()
-
-        serial_number = 1
-        if all_values:
-             serial_number = len(all_values)
-             expected_headers = ["序號", "日期時間", "檔案名稱", "YouTube網址", "歌曲標題", "藝術家", "專輯", "時長", "文件大小", "類別"]
-             if all_values[0] != expected_headers:
-                 serial_number = len(all_values) + 1
-
-        if not all_values:
-             serial_number = 1
-             expected_headers = ["序號", "日期時間", "檔案名稱", "YouTube網址", "歌曲標題", "藝術家", "專輯", "時長", "文件大小", "類別"]
-             try:
-                main_worksheet.update('A1', [expected_headers], value_input_option='USER_ENTERED')
-                print("偵測到工作表為空或標題行遺失，已自動補上標題行。")
-             except Exception as e_header:
-                print(f"嘗試補上標題行時發生錯誤: {e_header}")
-                return False
+        values = build_record_values(filename, youtube_url, file_path, metadata, category)
 
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        file_size_str = "N/A"
-        if file_path and os.path.exists(file_path):
-            file_size_str = get_file_size(file_path)
-
-        title = artist = album = duration_str = "未知"
-        if metadata:
-            title = metadata.get('title', '未知標題')
-            artist = metadata.get('artist', '未知藝人')
-            album = metadata.get('album', '未知專輯')
-            duration_str = metadata.get('duration', '未知時長')
-        elif file_path and os.path.exists(file_path) and filename.lower().endswith(".mp3"):
-            temp_metadata = get_mp3_metadata(file_path)
-            if temp_metadata:
-                title = temp_metadata.get('title', '未知標題')
-                artist = temp_metadata.get('artist', '未知藝人')
-                album = temp_metadata.get('album', '未知專輯')
-                duration_str = temp_metadata.get('duration', '未知時長')
-
-        # 新增類別欄位
-        new_row = [
-            str(serial_number),
-            now,
-            filename,
-            youtube_url,
-            title,
-            artist,
-            album,
-            duration_str,
-            file_size_str,
-            category if category else "未分類"
-        ]
-
-        main_worksheet.append_row(new_row, value_input_option='USER_ENTERED')
-        print(f"記錄已新增至主要工作表「下載記錄」")
+        queue_sheet_append("下載記錄", values)
+        print(f"記錄已排入主要工作表「下載記錄」的寫入佇列")
 
         # 如果有選擇類別，也加到對應的分類工作表中
         if category:
             try:
-                category_worksheet = spreadsheet.worksheet(category)
-                category_values = category_worksheet.get_all_values()
-
-                category_serial = 1
-                if category_values:
-                    category_serial = len(category_values)
-                    if category_values[0][0] == "序號":
-                        category_serial = len(category_values)
-                    else:
-                        category_serial = len(category_values) + 1
-
-                new_row[0] = str(category_serial)
-
-                category_worksheet.append_row(new_row, value_input_option='USER_ENTERED')
-                print(f"記錄也已新增至分類工作表「{category}」")
+                queue_sheet_append(category, values)
+                print(f"記錄也已排入分類工作表「{category}」的寫入佇列")
             except Exception as e:
                 print(f"添加到分類工作表時發生錯誤: {str(e)}")
 
-        try:
-            for ws_name in ["下載記錄"] + ([category] if category else []):
-                ws = spreadsheet.worksheet(ws_name)
-                all_ws_values = ws.get_all_values()
-                new_row_index = len(all_ws_values)
-
-                requests = [{
-                    "repeatCell": {
-                        "range": {
-                            "sheetId": ws.id,
-                            "startRowIndex": new_row_index - 1,
-                            "endRowIndex": new_row_index,
-                            "startColumnIndex": 0,
-                            "endColumnIndex": 10  # 更新為10欄
-                        },
-                        "cell": {
-                            "userEnteredFormat": {
-                                "horizontalAlignment": "LEFT"
-                            }
-                        },
-                        "fields": "userEnteredFormat.horizontalAlignment"
-                    }
-                }]
-
-                spreadsheet.batch_update({"requests": requests})
-        except Exception as e:
-            print(f"設置新行格式時發生錯誤: {e}")
-
         return True
     except Exception as e:
         print(f"新增記錄到 Google Sheet 時發生錯誤: {str(e)}")
@@ -408,37 +1346,360 @@ def setup_cookies():
         print("無效選擇，不使用特殊參數")
         return ""
 
-def setup_download_interval():
-    """設定下載間隔時間"""
-    print("\n=== 設定下載間隔 ===")
-    print("為了避免 YouTube 429 錯誤，建議設定適當的下載間隔")
+def ytdlp_progress_hook(progress):
+    if progress.get('status') == 'finished':
+        print("音訊下載完成，排入轉檔...")
+        # 只有實際傳輸時才有 elapsed（檔案已存在時沒有），頻寬調節只看傳輸本身，不含頁面與播放器解析
+        if progress.get('elapsed') and progress.get('downloaded_bytes'):
+            ytdlp_engines.last_transfer = (progress['downloaded_bytes'], progress['elapsed'])
 
-    min_interval = int(input("請設定最小下載間隔（秒）[預設30]: ") or "30")
-    max_interval = int(input("請設定最大下載間隔（秒）[預設60]: ") or "60")
+def ytdlp_postprocessor_hook(progress):
+    # 每個後處理步驟完成時記下檔案路徑，最後一個步驟（移動檔案）的路徑即為最終輸出檔
+    if progress.get('status') == 'finished':
+        ytdlp_engines.last_filepath = progress.get('info_dict', {}).get('filepath')
 
-    if max_interval < min_interval:
-        max_interval = min_interval
-        print(f"最大間隔已調整為 {max_interval} 秒（不能小於最小間隔）")
+def get_ytdlp_engine(cli_args):
+    """
+    取得目前執行緒中對應這組命令列參數的 YoutubeDL 實例
+    實例會被重複使用，連線、cookies 與 extractor 狀態不必每次重建
+    無法使用程序內引擎時回傳 None，由呼叫端改用子程序
+    """
+    global use_inprocess_ytdlp
+    if not use_inprocess_ytdlp:
+        return None
 
-    print(f"已設定下載間隔：{min_interval} - {max_interval} 秒")
-    return min_interval, max_interval
+    engines = getattr(ytdlp_engines, 'engines', None)
+    if engines is None:
+        engines = ytdlp_engines.engines = {}
+    if cli_args in engines:
+        return engines[cli_args]
+
+    try:
+        import yt_dlp
+        ydl_opts = yt_dlp.parse_options(shlex.split(cli_args)).ydl_opts
+        ydl_opts.update({
+            # 命令列預設的 ignoreerrors='only_download' 會讓失敗（含 429）只記錄錯誤並回傳 None，
+            # 改為拋出例外，失敗才會交給下載排程器退避與重試
+            'ignoreerrors': False,
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'progress_hooks': [ytdlp_progress_hook],
+            'postprocessor_hooks': [ytdlp_postprocessor_hook]
+        })
+        engines[cli_args] = yt_dlp.YoutubeDL(ydl_opts)
+        return engines[cli_args]
+    except (Exception, SystemExit) as e:
+        print(f"無法使用程序內 yt-dlp 引擎，改用子程序執行: {str(e)}")
+        use_inprocess_ytdlp = False
+        return None
+
+def ytdlp_download(youtube_url, cli_args, output_template=None):
+    """
+    下載單一網址，回傳 (是否成功, 錯誤訊息, 最終輸出檔路徑, 影片資訊)
+    output_template 每次下載都不同，不放進 cli_args，程序內引擎才能依參數重複使用
+    """
+    ydl = get_ytdlp_engine(cli_args)
+    if ydl is not None:
+        try:
+            if output_template:
+                ydl.params['outtmpl']['default'] = output_template
+            ytdlp_engines.last_filepath = None
+            ytdlp_engines.last_transfer = None
+            info = ydl.extract_info(youtube_url, download=True)
+            if info is None:
+                return False, f"yt-dlp 沒有回傳影片資訊: {youtube_url}", None, None
+            file_path = ytdlp_engines.last_filepath
+            if not file_path and info.get('requested_downloads'):
+                file_path = info['requested_downloads'][-1].get('filepath')
+            return True, "", file_path, info
+        except Exception as e:
+            return False, str(e), None, None
+
+    # 讓 yt-dlp 在檔案移動到最終位置後印出影片資訊（含 filepath）
+    if output_template:
+        cli_args = f'{cli_args} -o "{output_template}"'
+    command = f'yt-dlp {cli_args} --print "after_move:%()j" "{youtube_url}"'
+    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        return False, result.stderr, None, None
+    lines = [line for line in result.stdout.splitlines() if line.strip()]
+    try:
+        info = json.loads(lines[-1]) if lines else {}
+    except json.JSONDecodeError:
+        info = {}
+    return True, "", info.get('filepath'), info
+
+def ytdlp_search(search_query, cli_args="", flat=False):
+    """
+    執行搜尋（如 ytsearch10:歌名），回傳 (影片資訊列表, 錯誤訊息)
+    flat=True 時只取得搜尋列表上的欄位（標題、頻道、觀看次數、時長），不逐一解析影片
+    """
+    if flat:
+        cli_args = f"{cli_args} --flat-playlist".strip()
+    ydl = get_ytdlp_engine(cli_args)
+    if ydl is not None:
+        try:
+            result = ydl.extract_info(search_query, download=False)
+            if result is None:
+                return None, f"yt-dlp 沒有回傳搜尋結果: {search_query}"
+            return [entry for entry in result.get('entries') or [] if entry], ""
+        except Exception as e:
+            return None, str(e)
+
+    command = f'yt-dlp {cli_args} --dump-json "{search_query}"'
+    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr
+
+    entries = []
+    for line in result.stdout.strip().split('\n'):
+        if line:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return entries, ""
+
+def ytdlp_search_stream(search_query, cli_args="", stop_event=None):
+    """
+    逐筆產生扁平搜尋結果（或播放清單、頻道中的影片），不等待整個搜尋完成
+    stop_event 被設定後停止產生結果，並終止仍在執行的 yt-dlp 子程序
+    """
+    stop_event = stop_event or threading.Event()
+    cli_args = f"{cli_args} --flat-playlist".strip()
+
+    ydl = get_ytdlp_engine(cli_args)
+    if ydl is not None:
+        # process=False 時 entries 是延遲產生的，取到一筆就能先顯示一筆
+        result = ydl.extract_info(search_query, download=False, process=False) or {}
+        # 未處理的結果不會自動跟隨轉址，需自行以轉址的目標再擷取一次（子程序會自動處理）
+        for _ in range(max_ytdlp_url_redirects):
+            if result.get('_type') not in ('url', 'url_transparent') or not result.get('url'):
+                break
+            result = ydl.extract_info(result['url'], download=False, process=False,
+                                      ie_key=result.get('ie_key')) or {}
+        for entry in result.get('entries') or []:
+            if stop_event.is_set():
+                return
+            if entry:
+                yield entry
+        return
+
+    command = f'yt-dlp {cli_args} --dump-json "{search_query}"'
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    def terminate_on_stop():
+        while not stop_event.wait(0.2):
+            if process.poll() is not None:
+                return
+        if process.poll() is None:
+            process.terminate()
+
+    threading.Thread(target=terminate_on_stop, daemon=True).start()
+    try:
+        for line in process.stdout:
+            if stop_event.is_set():
+                return
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        if process.wait() != 0 and not stop_event.is_set():
+            raise RuntimeError(process.stderr.read())
+    finally:
+        if process.poll() is None:
+            process.terminate()
+
+def print_search_result(index, video):
+    owned_mark = " ✓ 已擁有" if is_video_owned(video['url']) else ""
+    print(f"{index}. {video['title']} - {video['channel']} ({video['view_count_text']} 觀看次數, {video['duration_text']}){owned_mark}")
+
+def normalize_search_query(song_name):
+    return " ".join(song_name.lower().split())
+
+def load_search_cache():
+    global search_cache
+    if search_cache is None:
+        try:
+            with open(search_cache_path, 'r', encoding='utf-8') as f:
+                search_cache = json.load(f)
+        except (OSError, ValueError):
+            search_cache = {}
+    return search_cache
+
+def get_cached_search(song_name):
+    """回傳仍在有效期限內的快取搜尋結果，沒有則回傳 None"""
+    with search_cache_lock:
+        entry = load_search_cache().get(normalize_search_query(song_name))
+        if entry and time.time() - entry['time'] < search_cache_ttl:
+            return entry['videos']
+    return None
+
+def save_search_result(song_name, videos):
+    with search_cache_lock:
+        cache = load_search_cache()
+        now = time.time()
+        cache[normalize_search_query(song_name)] = {'time': now, 'videos': videos}
+
+        for key in [key for key, entry in cache.items() if now - entry['time'] >= search_cache_ttl]:
+            del cache[key]
+        if len(cache) > search_cache_max_entries:
+            for key in sorted(cache, key=lambda key: cache[key]['time'])[:len(cache) - search_cache_max_entries]:
+                del cache[key]
+
+        try:
+            with open(search_cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"寫入搜尋快取時發生錯誤: {str(e)}")
+
+def build_search_result(video_info):
+    """將 yt-dlp 的影片資訊轉為顯示用的搜尋結果"""
+    duration = int(video_info.get('duration') or 0)
+    view_count = video_info.get('view_count') or 0
+    url = video_info.get('webpage_url') or video_info.get('url') or ''
+    if not url.startswith('http') and video_info.get('id'):
+        url = f"https://www.youtube.com/watch?v={video_info['id']}"
+
+    return {
+        'title': video_info.get('title', '未知標題'),
+        'url': url,
+        'channel': video_info.get('channel') or video_info.get('uploader') or '未知頻道',
+        'view_count': view_count,
+        'view_count_text': format_view_count(view_count),
+        'duration': duration,
+        'duration_text': format_duration(duration)
+    }
+
+def normalize_title_text(text):
+    """轉小寫、去除標點與 Official Video、MV 之類的填充字，回傳字詞列表"""
+    words = re.split(r"[\s\W_]+", text.lower())
+    return [word for word in words if word and word not in search_filler_words]
+
+def contains_search_term(text, term):
+    """拉丁字母的詞以字詞邊界比對（live 不會比對到 Oliver），中日文沒有空白，以子字串比對"""
+    if term.isascii():
+        return re.search(rf"\b{re.escape(term)}\b", text) is not None
+    return term in text
+
+def score_search_result(song_name, video):
+    """
+    依標題相似度、頻道（官方或 Topic）、觀看次數與時長是否像一首歌，為搜尋結果打 0 到 1 的分數
+    """
+    query_words = normalize_title_text(song_name)
+    title_words = normalize_title_text(video['title'])
+    channel = video['channel'].lower()
+    searchable = " ".join(title_words) + " " + channel
+
+    # 歌名的每個字詞都應出現在標題或頻道名稱中（中文沒有空白，以子字串比對）
+    coverage = sum(1 for word in query_words if word in searchable) / len(query_words) if query_words else 0
+    ratio = SequenceMatcher(None, " ".join(query_words), " ".join(title_words)).ratio()
+    similarity = 0.7 * coverage + 0.3 * ratio
+
+    if channel.endswith(" - topic"):
+        channel_score = 1.0
+    elif "vevo" in channel or "official" in channel or "官方" in channel:
+        channel_score = 0.9
+    elif any(word in channel for word in query_words if len(word) > 1):
+        channel_score = 0.7
+    elif "official" in video['title'].lower():
+        channel_score = 0.5
+    else:
+        channel_score = 0.2
+
+    view_score = min(1.0, math.log10(video['view_count'] + 1) / 7) if video['view_count'] else 0.0
+
+    duration = video['duration']
+    if not duration:
+        duration_score = 0.5
+    elif 90 <= duration <= 600:
+        duration_score = 1.0
+    elif duration < 90:
+        duration_score = max(0.0, (duration - 30) / 60)
+    else:
+        duration_score = max(0.0, (900 - duration) / 300)
+
+    query_text = " ".join(query_words)
+    title_text = video['title'].lower()
+    penalty = sum(0.25 for word in search_noise_words
+                  if contains_search_term(title_text, word) and not contains_search_term(query_text, word))
+
+    score = 0.5 * similarity + 0.2 * channel_score + 0.15 * view_score + 0.15 * duration_score - penalty
+    return round(min(1.0, max(0.0, score)), 3)
+
+def rank_search_results(song_name, videos):
+    """回傳依分數由高到低排序的 (分數, 影片) 列表"""
+    ranked = [(score_search_result(song_name, video), video) for video in videos]
+    ranked.sort(key=lambda pair: pair[0], reverse=True)
+    return ranked
+
+def resolve_song_name(song_name, extra_params=""):
+    """
+    搜尋一個歌名並排序結果，回傳 (排序後的結果, 錯誤訊息)
+    搜尋前向下載排程器取得配額，批次搜尋與下載共用同一個速率限制，被限流時同樣會退避重試
+    """
+    videos = get_cached_search(song_name)
+    if videos is not None:
+        return rank_search_results(song_name, videos), ""
+
+    error_text = ""
+    for attempt in range(1, max_download_attempts + 1):
+        download_scheduler.acquire()
+        with timed_stage("search", {'url': song_name, 'category': None}):
+            entries, error_text = ytdlp_search(f"ytsearch{search_result_count}:{song_name}", extra_params, flat=True)
+        if entries is not None:
+            download_scheduler.record_success()
+            videos = [build_search_result(entry) for entry in entries]
+            if videos:
+                save_search_result(song_name, videos)
+            return rank_search_results(song_name, videos), ""
+        kind = download_scheduler.record_failure(error_text)
+        if kind not in ("rate_limited", "throttled"):
+            break
+    return [], error_text
+
+def resolve_song_names(song_names, extra_params="", workers=search_workers):
+    """
+    同時搜尋多個歌名，依輸入順序回傳每個歌名的 (排序後的結果, 錯誤訊息)
+    """
+    results = [None] * len(song_names)
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(resolve_song_name, name, extra_params): index
+                   for index, name in enumerate(song_names)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = ([], str(e))
+            completed += 1
+            ranked, error_text = results[index]
+            if ranked:
+                best_score, best = ranked[0]
+                mark = "✓" if best_score >= search_confidence_threshold else "?"
+                print(f"[{completed}/{len(song_names)}] {mark} {song_names[index]} → {best['title']} ({best_score:.2f})")
+            else:
+                print(f"[{completed}/{len(song_names)}] ✗ {song_names[index]}: {error_text.strip() or '找不到相關影片'}")
+    return results
 
 def test_youtube_connection(extra_params):
     print("測試與YouTube的連接...")
 
-    test_cmd = f'yt-dlp --dump-json "ytsearch1:test" {extra_params}'
-    result = subprocess.run(test_cmd, shell=True, capture_output=True, text=True)
+    entries, error_text = ytdlp_search("ytsearch1:test", extra_params)
 
-    if result.returncode == 0:
+    if entries:
         print("✅ YouTube連接正常!")
         return True
     else:
-        if "429" in result.stderr:
+        if "429" in error_text:
             print("❌ 仍然出現429錯誤，可能需要使用更有效的cookies或等待一段時間再試")
-        elif "Unable to download webpage" in result.stderr:
+        elif "Unable to download webpage" in error_text:
             print("❌ 無法連接到YouTube，請檢查網絡連接")
         else:
-            print(f"❌ 連接測試失敗: {result.stderr}")
+            print(f"❌ 連接測試失敗: {error_text}")
         return False
 
 def sanitize_filename(filename):
@@ -473,12 +1734,12 @@ def check_duplicate_and_handle(filename, metadata, file_path, category=None):
         return True, None
 
     try:
-        all_data = worksheet.get_all_values()
-        if len(all_data) <= 1:
+        # 由本地鏡像的檔案名稱索引直接取出相同檔名的列（含尚在寫入佇列中的記錄）
+        data_rows = find_sheet_rows("下載記錄", filename=filename)
+        if not data_rows:
             return True, None
 
-        headers = all_data[0]
-        data_rows = all_data[1:]
+        headers = get_sheet_mirror("下載記錄")["headers"]
 
         filename_idx = headers.index("檔案名稱") if "檔案名稱" in headers else -1
         title_idx = headers.index("歌曲標題") if "歌曲標題" in headers else -1
@@ -500,10 +1761,10 @@ def check_duplicate_and_handle(filename, metadata, file_path, category=None):
 
         all_matches = []
 
-        for i, row in enumerate(data_rows):
+        for row_index, row in data_rows:
             if filename_idx < len(row) and row[filename_idx] == filename:
                 row_info = {
-                    "row_index": i + 2,
+                    "row_index": row_index,
                     "filename": row[filename_idx],
                     "title": row[title_idx] if title_idx != -1 and title_idx < len(row) else "",
                     "duration": row[duration_idx] if duration_idx != -1 and duration_idx < len(row) else "",
@@ -548,7 +1809,7 @@ def check_duplicate_and_handle(filename, metadata, file_path, category=None):
                 print("新檔案較大，將保留新檔案並更新記錄。")
                 return True, [m['row_index'] for m in all_matches]
             else:
-                choice = input("現有檔案較大或相同大小，是否仍要覆蓋? (y/n): ").lower()
+                choice = ask("現有檔案較大或相同大小，是否仍要覆蓋? (y/n): ", "duplicate_overwrite").lower()
                 if choice == 'y':
                     print("用戶選擇覆蓋，將更新記錄。")
                     return True, [m['row_index'] for m in all_matches]
@@ -567,7 +1828,7 @@ def check_duplicate_and_handle(filename, metadata, file_path, category=None):
             print(f"現有檔案: {duplicate_info['filename']}, 標題: {duplicate_info['title']}, 時長: {duplicate_info['duration']}")
             print(f"新檔案: {filename}, 標題: {current_title}, 時長: {current_duration}")
 
-            choice = input("是否覆蓋現有檔案? (y/n): ").lower()
+            choice = ask("是否覆蓋現有檔案? (y/n): ", "name_conflict_overwrite").lower()
             if choice == 'y':
                 print("用戶選擇覆蓋，將更新記錄。")
                 return True, [m['row_index'] for m in all_matches]
@@ -607,105 +1868,32 @@ def check_duplicate_and_handle(filename, metadata, file_path, category=None):
         return True, None
 
 def update_existing_record(row_index, filename, youtube_url, file_path=None, metadata=None, category=None):
-    """更新已存在的記錄"""
+    """更新已存在的記錄，row_index 可為單一列號或列號清單"""
     global worksheet, spreadsheet
     if not spreadsheet:
         print("Google Sheet 尚未初始化。無法更新記錄。")
         return False
 
     try:
-        main_worksheet = spreadsheet.worksheet("下載記錄")
-
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        file_size_str = "N/A"
-        if file_path and os.path.exists(file_path):
-            file_size_str = get_file_size(file_path)
-
-        title = artist = album = duration_str = "未知"
-        if metadata:
-            title = metadata.get('title', '未知標題')
-            artist = metadata.get('artist', '未知藝人')
-            album = metadata.get('album', '未知專輯')
-            duration_str = metadata.get('duration', '未知時長')
-        elif file_path and os.path.exists(file_path) and filename.lower().endswith(".mp3"):
-            temp_metadata = get_mp3_metadata(file_path)
-            if temp_metadata:
-                title = temp_metadata.get('title', '未知標題')
-                artist = temp_metadata.get('artist', '未知藝人')
-                album = temp_metadata.get('album', '未知專輯')
-                duration_str = temp_metadata.get('duration', '未知時長')
-
-        # 修改：更新範圍包含類別欄位
-        range_name = f'B{row_index}:J{row_index}'
-        values = [[
-            now,
-            filename,
-            youtube_url,
-            title,
-            artist,
-            album,
-            duration_str,
-            file_size_str,
-            category if category else "未分類"
-        ]]
-
-        main_worksheet.update(range_name, values, value_input_option='USER_ENTERED')
-        print(f"已更新「下載記錄」工作表中的記錄第 {row_index} 行")
+        values = build_record_values(filename, youtube_url, file_path, metadata, category)
+        row_indexes = row_index if isinstance(row_index, (list, tuple)) else [row_index]
+
+        for index in row_indexes:
+            queue_sheet_update("下載記錄", index, values)
+            print(f"已排入「下載記錄」工作表第 {index} 行的更新")
 
         # 修改：使用傳入的類別參數而非重新選擇
         if category:
             try:
-                category_worksheet = spreadsheet.worksheet(category)
-                all_category_records = category_worksheet.get_all_values()
+                category_rows = find_sheet_rows(category, filename=filename)
+                category_row_index = category_rows[0][0] if category_rows else -1
 
-                found_in_category = False
-                category_row_index = -1
-
-                for i, row in enumerate(all_category_records[1:], 2):
-                    if len(row) >= 3 and row[2] == filename:
-                        found_in_category = True
-                        category_row_index = i
-                        break
-
-                if found_in_category:
-                    range_name = f'B{category_row_index}:J{category_row_index}'
-                    category_worksheet.update(range_name, values, value_input_option='USER_ENTERED')
-                    print(f"已更新「{category}」工作表中的記錄第 {category_row_index} 行")
+                if category_row_index != -1:
+                    queue_sheet_update(category, category_row_index, values)
+                    print(f"已排入「{category}」工作表第 {category_row_index} 行的更新")
                 else:
-                    category_serial = len(all_category_records)
-                    if all_category_records[0][0] == "序號":
-                        category_serial = len(all_category_records)
-                    else:
-                        category_serial = len(all_category_records) + 1
-
-                    new_row = [str(category_serial)] + values[0]
-                    category_worksheet.append_row(new_row, value_input_option='USER_ENTERED')
-                    print(f"記錄已新增至分類工作表「{category}」")
-
-                    try:
-                        new_row_index = len(all_category_records) + 1
-
-                        requests = [{
-                            "repeatCell": {
-                                "range": {
-                                    "sheetId": category_worksheet.id,
-                                    "startRowIndex": new_row_index - 1,
-                                    "endRowIndex": new_row_index,
-                                    "startColumnIndex": 0,
-                                    "endColumnIndex": 10  # 更新為10欄
-                                },
-                                "cell": {
-                                    "userEnteredFormat": {
-                                        "horizontalAlignment": "LEFT"
-                                    }
-                                },
-                                "fields": "userEnteredFormat.horizontalAlignment"
-                            }
-                        }]
-
-                        spreadsheet.batch_update({"requests": requests})
-                    except Exception as e:
-                        print(f"設置新行格式時發生錯誤: {e}")
+                    queue_sheet_append(category, values)
+                    print(f"記錄已排入分類工作表「{category}」的寫入佇列")
             except Exception as e:
                 print(f"處理分類記錄時發生錯誤: {str(e)}")
 
@@ -714,6 +1902,452 @@ def update_existing_record(row_index, filename, youtube_url, file_path=None, met
         print(f"更新記錄到 Google Sheet 時發生錯誤: {str(e)}")
         return False
 
+def convert_duration_to_seconds(duration_str):
+    parts = duration_str.split(':')
+    try:
+        if len(parts) == 2:
+            return int(parts[0]) * 60 + int(parts[1])
+        elif len(parts) == 3:
+            return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
+    except ValueError:
+        pass
+    return 0
+
+def get_library_index():
+    """開啟（必要時建立）音樂庫索引資料庫"""
+    global library_index_conn
+    if library_index_conn is None:
+        conn = sqlite3.connect(library_index_path, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS library_files ("
+            "path TEXT PRIMARY KEY, folder TEXT, mtime REAL, size INTEGER, "
+            "title TEXT, artist TEXT, album TEXT, duration TEXT, duration_seconds INTEGER)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_library_title "
+            "ON library_files (folder, title, duration_seconds)"
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(library_files)")]
+        if "fingerprint" not in columns:
+            conn.execute("ALTER TABLE library_files ADD COLUMN fingerprint BLOB")
+        conn.commit()
+        library_index_conn = conn
+    return library_index_conn
+
+def library_index_row(file_path, metadata=None, stat=None, fingerprint=None):
+    """組出一筆索引資料；檔案內容變動後舊的指紋不再有效，未提供時清空"""
+    stat = stat or os.stat(file_path)
+    metadata = metadata or get_audio_metadata(file_path)
+    return (file_path, os.path.dirname(file_path), stat.st_mtime, stat.st_size,
+            metadata['title'], metadata['artist'], metadata['album'], metadata['duration'],
+            convert_duration_to_seconds(metadata['duration']), fingerprint)
+
+def write_library_index_rows(rows):
+    """以單一交易寫入多筆索引資料；索引在雲端硬碟上，每次 commit 都是一次緩慢的日誌寫入"""
+    global fingerprint_matrix_cache
+    with library_index_lock:
+        conn = get_library_index()
+        conn.executemany(
+            "INSERT OR REPLACE INTO library_files "
+            "(path, folder, mtime, size, title, artist, album, duration, duration_seconds, fingerprint) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        fingerprint_matrix_cache = None
+
+def update_library_index(file_path, metadata=None, stat=None, fingerprint=None):
+    """新增或更新單一檔案的索引資料"""
+    try:
+        write_library_index_rows([library_index_row(file_path, metadata, stat, fingerprint)])
+    except Exception as e:
+        print(f"更新音樂庫索引時發生錯誤: {str(e)}")
+
+def remove_library_index_paths(paths):
+    """以單一交易移除多個檔案的索引資料"""
+    global fingerprint_matrix_cache
+    with library_index_lock:
+        conn = get_library_index()
+        conn.executemany("DELETE FROM library_files WHERE path = ?", [(path,) for path in paths])
+        conn.commit()
+        fingerprint_matrix_cache = None
+
+def remove_from_library_index(file_path):
+    try:
+        remove_library_index_paths([file_path])
+    except Exception as e:
+        print(f"從音樂庫索引移除 {os.path.basename(file_path)} 時發生錯誤: {str(e)}")
+
+def sync_library_folder(folder, force=False):
+    """
+    將資料夾與索引同步：只重新讀取 mtime 或大小有變動的檔案，並移除已不存在的檔案
+    每個資料夾在一次執行中只完整同步一次，之後由本程式的寫入操作維持索引
+    """
+    if folder in synced_library_folders and not force:
+        return
+
+    try:
+        with library_index_lock:
+            indexed = {
+                path: (mtime, size)
+                for path, mtime, size in get_library_index().execute(
+                    "SELECT path, mtime, size FROM library_files WHERE folder = ?", (folder,)
+                )
+            }
+
+        # 變動的檔案先收集起來，整個資料夾只寫入與提交一次
+        seen = set()
+        changed_rows = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(audio_extensions):
+                    continue
+                path = os.path.join(folder, entry.name)
+                seen.add(path)
+                stat = entry.stat()
+                if indexed.get(path) != (stat.st_mtime, stat.st_size):
+                    changed_rows.append(library_index_row(path, stat=stat))
+
+        if changed_rows:
+            write_library_index_rows(changed_rows)
+        removed = set(indexed) - seen
+        if removed:
+            remove_library_index_paths(removed)
+
+        synced_library_folders.add(folder)
+        if changed_rows:
+            print(f"音樂庫索引已更新 {len(changed_rows)} 個檔案: {folder}")
+    except Exception as e:
+        print(f"同步音樂庫索引時發生錯誤: {str(e)}")
+
+def decode_audio_samples(file_path):
+    """用 ffmpeg 將音訊解碼為單聲道 PCM，回傳 NumPy int16 陣列；無法解碼時回傳 None"""
+    import numpy as np
+    command = [
+        "ffmpeg", "-v", "error", "-i", file_path,
+        "-t", str(fingerprint_seconds + 30), "-ac", "1", "-ar", str(fingerprint_sample_rate),
+        "-f", "s16le", "-"
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True)
+    except OSError:
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+def compute_fingerprint(samples):
+    """
+    由 PCM 計算固定長度的指紋：去掉開頭靜音後取前 fingerprint_seconds 秒，
+    計算對數間隔頻帶的能量並平均成固定數量、大幅重疊的時間段（偏移不足一段時能量仍相近），
+    再以相鄰頻帶能量差在時間上的變化方向作為位元（Haitsma-Kalker 方法）
+    """
+    import numpy as np
+    samples = samples.astype(np.float32)
+    loud = np.flatnonzero(np.abs(samples) > 500)
+    if len(loud) == 0:
+        return None
+    samples = samples[loud[0]:loud[0] + fingerprint_seconds * fingerprint_sample_rate]
+
+    hop = fingerprint_frame_size // 4
+    segment_count = fingerprint_segments + fingerprint_window
+    if len(samples) < fingerprint_frame_size + hop * (segment_count + fingerprint_window):
+        return None
+    frames = np.lib.stride_tricks.sliding_window_view(samples, fingerprint_frame_size)[::hop]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(fingerprint_frame_size), axis=1)) ** 2
+
+    freqs = np.fft.rfftfreq(fingerprint_frame_size, 1 / fingerprint_sample_rate)
+    edges = np.geomspace(300, 3000, fingerprint_bands + 1)
+    band_of_bin = np.digitize(freqs, edges) - 1
+    valid = (band_of_bin >= 0) & (band_of_bin < fingerprint_bands)
+    energies = np.zeros((len(frames), fingerprint_bands), dtype=np.float64)
+    np.add.at(energies.T, band_of_bin[valid], spectrum[:, valid].T)
+
+    bounds = np.linspace(0, len(energies), segment_count + fingerprint_window).astype(int)
+    segments = np.array([energies[bounds[i]:bounds[i + fingerprint_window]].mean(axis=0)
+                         for i in range(segment_count)])
+    band_diff = np.diff(np.log1p(segments), axis=1)
+    bits = band_diff[fingerprint_window:] > band_diff[:-fingerprint_window]
+    return np.packbits(bits.ravel()).tobytes()
+
+def compute_file_fingerprint(file_path):
+    """計算檔案的音訊指紋；沒有 NumPy 或 ffmpeg 時回傳 None，指紋比對會被略過"""
+    try:
+        samples = decode_audio_samples(file_path)
+        return compute_fingerprint(samples) if samples is not None else None
+    except ImportError:
+        return None
+    except Exception as e:
+        print(f"計算音訊指紋 {os.path.basename(file_path)} 時發生錯誤: {str(e)}")
+        return None
+
+def load_fingerprint_matrix():
+    """把索引中的所有指紋載入為 (檔案數, 位元組數) 的 uint8 矩陣，索引有寫入時才重新載入"""
+    global fingerprint_matrix_cache
+    import numpy as np
+    with library_index_lock:
+        if fingerprint_matrix_cache is None:
+            rows = get_library_index().execute(
+                "SELECT path, title, artist, album, duration, fingerprint FROM library_files "
+                "WHERE fingerprint IS NOT NULL"
+            ).fetchall()
+            # 舊版設定計算的指紋長度不同，無法比對，由 fingerprint_library 重新計算
+            rows = [row for row in rows if len(row[5]) == fingerprint_size]
+            matrix = np.frombuffer(b"".join(row[5] for row in rows), dtype=np.uint8).reshape(
+                len(rows), fingerprint_segments, fingerprint_row_bytes)
+            fingerprint_matrix_cache = (rows, matrix)
+        return fingerprint_matrix_cache
+
+def find_fingerprint_matches(fingerprint, current_file):
+    """
+    以向量化的 XOR + popcount 比對整個音樂庫，回傳音訊內容相同的檔案；
+    每個平移量比對一次重疊的時間段，取最小的距離
+    """
+    if not fingerprint or len(fingerprint) != fingerprint_size:
+        return []
+    try:
+        import numpy as np
+        rows, matrix = load_fingerprint_matrix()
+        if not rows:
+            return []
+
+        popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1, dtype=np.uint8)
+        query = np.frombuffer(fingerprint, dtype=np.uint8).reshape(fingerprint_segments, fingerprint_row_bytes)
+        distances = np.ones(len(rows))
+        for shift in range(-fingerprint_max_shift, fingerprint_max_shift + 1):
+            # shift > 0：新檔案的開頭比音樂庫中的檔案多出 shift 段
+            overlap = fingerprint_segments - abs(shift)
+            library_part = matrix[:, max(0, -shift):max(0, -shift) + overlap]
+            query_part = query[max(0, shift):max(0, shift) + overlap]
+            differing = popcount[np.bitwise_xor(library_part, query_part)].sum(axis=(1, 2), dtype=np.uint32)
+            distances = np.minimum(distances, differing / (overlap * fingerprint_row_bytes * 8))
+
+        matches = []
+        for i in np.flatnonzero(distances < fingerprint_match_threshold):
+            path, title, artist, album, duration, _ = rows[i]
+            if path != current_file and final_path_exists(path):
+                matches.append((path, {'title': title, 'artist': artist, 'album': album, 'duration': duration}))
+        return matches
+    except ImportError:
+        return []
+    except Exception as e:
+        print(f"比對音訊指紋時發生錯誤: {str(e)}")
+        return []
+
+def fingerprint_library():
+    """為音樂庫中尚未有指紋（或指紋為舊版長度）的檔案計算指紋（多執行緒，ffmpeg 解碼在子程序中進行）"""
+    for folder in [base_output_dir] + list(category_folders.values()):
+        sync_library_folder(folder)
+
+    with library_index_lock:
+        rows = get_library_index().execute(
+            "SELECT path, title, artist, album, duration FROM library_files "
+            "WHERE fingerprint IS NULL OR length(fingerprint) != ?", (fingerprint_size,)
+        ).fetchall()
+    if not rows:
+        print("所有檔案都已有音訊指紋。")
+        return
+
+    print(f"正在為 {len(rows)} 個檔案計算音訊指紋...")
+    done = 0
+
+    def fingerprint_row(row):
+        path, title, artist, album, duration = row
+        fingerprint = compute_file_fingerprint(path)
+        if fingerprint:
+            update_library_index(path, {'title': title, 'artist': artist, 'album': album, 'duration': duration},
+                                 fingerprint=fingerprint)
+        return fingerprint is not None
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as executor:
+        for ok in executor.map(fingerprint_row, rows):
+            done += ok
+    print(f"完成! 已計算 {done}/{len(rows)} 個檔案的音訊指紋")
+
+def scan_library_files():
+    """同時列出根目錄與各分類資料夾中的音訊檔，回傳 (類別, 路徑, 大小) 列表；根目錄的類別為 None"""
+    folders = [(None, base_output_dir)] + list(category_folders.items())
+
+    def scan_folder(folder_entry):
+        category, folder = folder_entry
+        files = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(audio_extensions):
+                        files.append((category, entry.path, entry.stat().st_size))
+        except OSError as e:
+            print(f"無法讀取資料夾 {folder}: {str(e)}")
+        return files
+
+    with ThreadPoolExecutor(max_workers=len(folders)) as executor:
+        return [file for files in executor.map(scan_folder, folders) for file in files]
+
+def diff_library_with_sheet(files, metadata_by_path, rows):
+    """
+    一次比對音樂庫檔案與「下載記錄」的所有列，回傳各類不一致的項目：
+    orphan_files（沒有記錄的檔案）、orphan_rows（檔案已不存在或重複的記錄）、
+    miscategorized（檔案所在資料夾與記錄的類別不同）、drift（大小或時長與記錄不同）
+    """
+    headers = rows[0] if rows and rows[0] and rows[0][0] == "序號" else sheet_headers
+    column = {name: headers.index(name) if name in headers else sheet_headers.index(name) for name in sheet_headers}
+
+    files_by_name = {}
+    for category, path, size in files:
+        files_by_name.setdefault(os.path.basename(path), []).append((category, path))
+
+    report = {"orphan_files": [], "orphan_rows": [], "miscategorized": [], "drift": []}
+    matched_paths = set()
+    for row_index in range(2, len(rows) + 1):
+        row = rows[row_index - 1] + [""] * len(sheet_headers)
+        filename = row[column["檔案名稱"]]
+        row_category = row[column["類別"]]
+        row_category = None if row_category in ("", "未分類") else row_category
+        candidates = [(category, path) for category, path in files_by_name.get(filename, [])
+                      if path not in matched_paths]
+        if not filename or not candidates:
+            report["orphan_rows"].append({"row": row_index, "filename": filename, "category": row_category,
+                                          "url": row[column["YouTube網址"]], "duplicate": filename in files_by_name})
+            continue
+
+        category, path = next((c for c in candidates if c[0] == row_category), candidates[0])
+        matched_paths.add(path)
+        item = {"row": row_index, "filename": filename, "path": path, "category": category,
+                "url": row[column["YouTube網址"]], "sheet_category": row_category}
+        if category != row_category:
+            report["miscategorized"].append(item)
+
+        metadata = metadata_by_path[path]
+        changes = []
+        actual_size = get_file_size(path)
+        if row[column["文件大小"]] != actual_size:
+            changes.append(f"大小 {row[column['文件大小']]} → {actual_size}")
+        recorded_seconds = convert_duration_to_seconds(row[column["時長"]])
+        actual_seconds = convert_duration_to_seconds(metadata['duration'])
+        if actual_seconds and abs(recorded_seconds - actual_seconds) > reconcile_duration_tolerance:
+            changes.append(f"時長 {row[column['時長']]} → {metadata['duration']}")
+        if changes:
+            report["drift"].append(dict(item, changes=changes))
+
+    for category, path, size in files:
+        if path not in matched_paths:
+            report["orphan_files"].append({"filename": os.path.basename(path), "path": path, "category": category})
+    return report
+
+def delete_sheet_rows(rows_by_sheet):
+    """以單一 batch_update 刪除多個工作表中的列；同一工作表由下往上刪，列號才不會位移"""
+    requests = []
+    for sheet_name, row_indexes in rows_by_sheet.items():
+        for row_index in sorted(set(row_indexes), reverse=True):
+            requests.append({
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": get_sheet_id(sheet_name),
+                        "dimension": "ROWS",
+                        "startIndex": row_index - 1,
+                        "endIndex": row_index
+                    }
+                }
+            })
+    if requests:
+        with timed_stage("sheet_write", {}):
+            sheets_request("write", spreadsheet.batch_update, {"requests": requests})
+        refresh_sheet_mirrors(list(rows_by_sheet))
+
+def reconcile_library(fix=False):
+    """
+    核對音樂庫資料夾與「下載記錄」工作表：同時掃描所有資料夾並平行讀取元數據，
+    再與工作表一次比對，列出沒有記錄的檔案、檔案已不存在的記錄、類別不符以及大小或時長不一致的項目
+    fix=True 時補上缺少的記錄、以檔案的實際資訊更新記錄，並刪除已不存在的檔案的記錄
+    回傳不一致項目的總數
+    """
+    if not spreadsheet:
+        print("Google Sheet 尚未初始化。無法核對音樂庫。")
+        return 0
+
+    started = time.perf_counter()
+    files = scan_library_files()
+    with ThreadPoolExecutor(max_workers=reconcile_workers) as executor:
+        metadata_by_path = dict(zip(
+            [path for _, path, _ in files],
+            executor.map(get_audio_metadata, [path for _, path, _ in files])
+        ))
+
+    # 以最新的試算表內容比對，避免使用在外部修改前載入的鏡像
+    refresh_sheet_mirrors(["下載記錄"])
+    with sheet_write_lock:
+        rows = [list(row) for row in get_sheet_mirror("下載記錄")["rows"]]
+    report = diff_library_with_sheet(files, metadata_by_path, rows)
+
+    titles = {
+        "orphan_files": "沒有記錄的檔案",
+        "orphan_rows": "檔案已不存在或重複的記錄",
+        "miscategorized": "類別不符",
+        "drift": "大小或時長不一致"
+    }
+    print(f"\n已核對 {len(files)} 個檔案與 {max(0, len(rows) - 1)} 筆記錄（{time.perf_counter() - started:.1f} 秒）")
+    for kind, title in titles.items():
+        print(f"{title}: {len(report[kind])} 項")
+        for item in report[kind][:reconcile_report_limit]:
+            where = f"第 {item['row']} 行 " if "row" in item else ""
+            category_text = item.get("category") or "未分類"
+            if kind == "miscategorized":
+                category_text = f"{item['sheet_category'] or '未分類'} → {category_text}"
+            changes = f"（{'、'.join(item['changes'])}）" if "changes" in item else ""
+            print(f"  {where}{item['filename']} [{category_text}]{changes}")
+        if len(report[kind]) > reconcile_report_limit:
+            print(f"  ...其餘 {len(report[kind]) - reconcile_report_limit} 項請見報告檔")
+
+    report_path = os.path.join(cache_dir, "reconcile", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    try:
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"完整報告: {report_path}")
+    except OSError as e:
+        print(f"保存核對報告時發生錯誤: {str(e)}")
+
+    total = sum(len(items) for items in report.values())
+    if not fix or not total:
+        return total
+
+    # 先排入新增與更新（列號仍對應目前的工作表），寫出後再一次刪除多餘的列
+    for item in report["orphan_files"]:
+        add_record_to_google_sheet(item["filename"], "", item["path"], metadata_by_path[item["path"]], item["category"])
+    fixed_rows = {}
+    for item in report["miscategorized"] + report["drift"]:
+        fixed_rows[item["row"]] = item
+    for row_index, item in sorted(fixed_rows.items()):
+        update_existing_record(row_index, item["filename"], item["url"], item["path"],
+                               metadata_by_path[item["path"]], item["category"])
+
+    # 刪除列會讓下方的列號位移，所有新增與更新都必須已經寫出；寫出失敗（記錄放回佇列）時不刪除
+    flushed = flush_sheet_writes()
+    with sheet_write_lock:
+        flushed = flushed and not sheet_write_queue
+    if not flushed:
+        print("修正的記錄尚未全部寫入試算表，為避免列號位移，本次不刪除多餘的記錄；請稍後再執行核對")
+        return total
+
+    rows_to_delete = {"下載記錄": [item["row"] for item in report["orphan_rows"]]}
+    stale_category_rows = [(item["sheet_category"], item["filename"]) for item in report["miscategorized"]]
+    # 重複的記錄所對應的檔案仍存在，分類工作表中同名的記錄要保留
+    stale_category_rows += [(item["category"], item["filename"]) for item in report["orphan_rows"] if not item["duplicate"]]
+    for sheet_name, filename in stale_category_rows:
+        if sheet_name in category_folders:
+            try:
+                rows_to_delete.setdefault(sheet_name, []).extend(
+                    row_index for row_index, _ in find_sheet_rows(sheet_name, filename=filename)
+                )
+            except Exception as e:
+                print(f"查詢分類工作表「{sheet_name}」時發生錯誤: {str(e)}")
+    try:
+        delete_sheet_rows(rows_to_delete)
+    except Exception as e:
+        print(f"刪除多餘的記錄時發生錯誤: {str(e)}")
+    print(f"已修正 {total} 項不一致")
+    return total
+
 def find_similar_files(metadata, current_file, output_dir):
     """
     查找與當前下載檔案的標題和時長都相同的檔案
@@ -724,249 +2358,573 @@ def find_similar_files(metadata, current_file, output_dir):
 
     similar_files = []
     target_title = metadata['title']
-    target_duration = metadata['duration']
+    target_duration_seconds = convert_duration_to_seconds(metadata['duration'])
 
-    def convert_duration_to_seconds(duration_str):
-        parts = duration_str.split(':')
-        if len(parts) == 2: 
-            return int(parts[0]) * 60 + int(parts[1])
-        elif len(parts) == 3:
-            return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
-        return 0
+    sync_library_folder(output_dir)
 
-    target_duration_seconds = convert_duration_to_seconds(target_duration)
-    
-    for mp3_file in glob.glob(f"{output_dir}/*.mp3"):
-        if mp3_file == current_file:
-            continue
+    with library_index_lock:
+        rows = get_library_index().execute(
+            "SELECT path, title, artist, album, duration FROM library_files "
+            "WHERE folder = ? AND title = ? AND duration_seconds BETWEEN ? AND ?",
+            (output_dir, target_title, target_duration_seconds - 1, target_duration_seconds + 1)
+        ).fetchall()
 
-        file_metadata = get_mp3_metadata(mp3_file)
-        if not file_metadata:
+    for path, title, artist, album, duration in rows:
+        if path == current_file:
             continue
-
-        if 'title' in file_metadata and file_metadata['title'] == target_title:
-            if 'duration' in file_metadata:
-                file_duration_seconds = convert_duration_to_seconds(file_metadata['duration'])
-                if abs(file_duration_seconds - target_duration_seconds) <= 1:
-                    similar_files.append((mp3_file, file_metadata))
+        if not final_path_exists(path):
+            remove_from_library_index(path)
+            continue
+        similar_files.append((path, {'title': title, 'artist': artist, 'album': album, 'duration': duration}))
 
     return similar_files
 
-def download_as_mp3(youtube_url, extra_params=""):
-    try:
-        print(f"正在處理: {youtube_url}")
-
-        category = select_song_category()
-        output_dir = get_output_directory(category)
+def is_move_pending(final_path):
+    """有暫存區的檔案正等待搬移到此路徑"""
+    with pending_moves_lock:
+        return final_path in pending_moves
 
-        output_template = f"{output_dir}/%(title)s.%(ext)s"
+def final_path_exists(final_path):
+    """分類資料夾中已有此檔，或有檔案正等待搬移到此路徑"""
+    return is_move_pending(final_path) or os.path.exists(final_path)
 
-        command = f'yt-dlp {extra_params} --no-playlist -x --audio-format mp3 --audio-quality 0 --add-metadata --embed-metadata --no-embed-thumbnail --no-write-thumbnail -o "{output_template}" "{youtube_url}"'
+def rename_staged_file(staged_path, new_filename):
+    new_staged_path = os.path.join(os.path.dirname(staged_path), new_filename)
+    os.rename(staged_path, new_staged_path)
+    return new_staged_path
 
-        print("正在下載...")
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+def queue_file_move(staged_path, final_path, metadata=None, fingerprint=None, youtube_url=None, on_moved=None):
+    """
+    將暫存區的完成檔排入背景搬移；搬移前先以最終路徑寫入音樂庫索引，讓後續的相似檔案檢查看得到
+    on_moved(是否成功) 在搬移結束後於搬移執行緒中呼叫
+    """
+    global file_mover
+    update_library_index(final_path, metadata, stat=os.stat(staged_path), fingerprint=fingerprint)
+    with pending_moves_lock:
+        if file_mover is None:
+            file_mover = ThreadPoolExecutor(max_workers=file_move_workers)
+        pending_moves[final_path] = file_mover.submit(
+            move_staged_file, staged_path, final_path, metadata, fingerprint, getattr(timing_context, "item", None),
+            youtube_url, on_moved
+        )
+    print(f"檔案將在背景搬移至: {final_path}")
+
+def move_staged_file(staged_path, final_path, metadata=None, fingerprint=None, timing_item=None,
+                     youtube_url=None, on_moved=None):
+    """
+    把暫存檔複製到雲端硬碟，確認大小一致後才刪除暫存檔並把影片標記為已擁有
+    執行階段在搬移完成前重置時，暫存檔會遺失，因此不能更早標記，否則之後無法重新下載
+    """
+    started = time.perf_counter()
+    moved = False
+    try:
+        expected_size = os.path.getsize(staged_path)
+        partial_path = final_path + ".part"
+        for attempt in range(1, file_move_attempts + 1):
+            try:
+                shutil.copyfile(staged_path, partial_path)
+                os.replace(partial_path, final_path)
+                if os.path.getsize(final_path) == expected_size:
+                    break
+                print(f"搬移後檔案大小不符，重試 ({attempt}/{file_move_attempts}): {os.path.basename(final_path)}")
+            except OSError as e:
+                print(f"搬移檔案時發生錯誤 ({attempt}/{file_move_attempts}): {str(e)}")
+        else:
+            print(f"⚠️ 無法搬移檔案，暫存檔保留在: {staged_path}")
+            return False
 
-        if result.returncode != 0:
-            print(f"下載失敗: {result.stderr}")
+        if youtube_url:
+            mark_video_owned(youtube_url)
+        moved = True
+        update_library_index(final_path, metadata, fingerprint=fingerprint)
+        os.remove(staged_path)
+        shutil.rmtree(os.path.dirname(staged_path), ignore_errors=True)
+        return True
+    finally:
+        record_stage("drive_write", time.perf_counter() - started, timing_item)
+        with pending_moves_lock:
+            pending_moves.pop(final_path, None)
+        if on_moved:
+            try:
+                on_moved(moved)
+            except Exception as e:
+                print(f"記錄搬移結果時發生錯誤: {str(e)}")
+
+def wait_for_pending_moves():
+    """等待所有背景搬移完成；執行階段結束前必須呼叫，以免遺失暫存區中的檔案"""
+    with pending_moves_lock:
+        futures = list(pending_moves.values())
+    if futures:
+        print(f"等待 {len(futures)} 個檔案搬移至雲端硬碟...")
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"背景搬移時發生錯誤: {str(e)}")
 
-            if "429" in result.stderr:
-                print("\n遇到429錯誤 (Too Many Requests)，這意味著YouTube認為我們的下載行為是自動程序。")
-                print("請嘗試以下解決方案:")
-                print("1. 等待一段時間後再試")
-                print("2. 使用cookies選項重新運行此程序")
-                print("3. 使用VPN或代理改變IP地址")
-                return False
-            return False
+atexit.register(wait_for_pending_moves)
 
-        files = glob.glob(f"{output_dir}/*.mp3")
-        if files:
-            latest_file = max(files, key=os.path.getctime)
-            filename = os.path.basename(latest_file)
+def next_free_name(output_dir, base_name, extension):
+    """在分類資料夾中找出不衝突的檔名，例如「歌名 (2).mp3」"""
+    number = 2
+    while final_path_exists(f"{output_dir}/{base_name} ({number}){extension}"):
+        number += 1
+    return f"{base_name} ({number}){extension}"
 
-            print("\n下載完成!")
-            print(f"檔案名稱: {filename}")
-
-            file_size = get_file_size(latest_file)
-            print(f"文件大小: {file_size}")
-
-            metadata = get_mp3_metadata(latest_file)
-            if metadata:
-                print(f"標題: {metadata['title']}")
-                print(f"演出者: {metadata['artist']}")
-                if metadata['album'] != '未知專輯':
-                    print(f"專輯: {metadata['album']}")
-                print(f"時長: {metadata['duration']}")
-
-            similar_files = find_similar_files(metadata, latest_file, output_dir)
-            if similar_files:
-                print("\n⚠️ 發現有標題和時長都相同的歌曲存在！可能是重複下載。")
-                print("\n=== 現有相似檔案 ===")
-                for i, (file_path, file_meta) in enumerate(similar_files):
-                    print(f"\n[檔案 {i+1}]")
-                    print(f"檔名: {os.path.basename(file_path)}")
-                    print(f"標題: {file_meta['title']}")
-                    print(f"演出者: {file_meta['artist']}")
-                    print(f"時長: {file_meta['duration']}")
-                    if file_meta['album'] != '未知專輯':
-                        print(f"專輯: {file_meta['album']}")
-                    print(f"檔案大小: {get_file_size(file_path)}")
-                    print(f"路徑: {file_path}")
-
-                print("\n=== 剛下載的檔案 ===")
-                print(f"檔名: {filename}")
-                print(f"標題: {metadata['title']}")
-                print(f"演出者: {metadata['artist']}")
-                print(f"時長: {metadata['duration']}")
-                if metadata['album'] != '未知專輯':
-                    print(f"專輯: {metadata['album']}")
-                print(f"檔案大小: {file_size}")
-                print(f"路徑: {latest_file}")
-
-                action = input("\n請選擇操作：\n1. 保留剛下載的檔案\n2. 刪除剛下載的檔案\n3. 保留全部\n請輸入選項 (1-3): ").strip()
-
-                if action == "2":
+def handle_downloaded_file(latest_file, youtube_url, output_dir, category=None, file_name=None, fingerprint=None,
+                           on_moved=None):
+    """
+    下載完成後的處理：相似檔案檢查、重新命名、重複檢查與寫入試算表
+    提供 file_name 時直接以它重新命名，不再詢問；fingerprint 由呼叫端在取得互動鎖之前算好
+    """
+    filename = os.path.basename(latest_file)
+
+    print("\n下載完成!")
+    print(f"檔案名稱: {filename}")
+
+    file_size = get_file_size(latest_file)
+    print(f"文件大小: {file_size}")
+
+    metadata = get_audio_metadata(latest_file)
+    if metadata:
+        print(f"標題: {metadata['title']}")
+        print(f"演出者: {metadata['artist']}")
+        if metadata['album'] != '未知專輯':
+            print(f"專輯: {metadata['album']}")
+        print(f"時長: {metadata['duration']}")
+
+    with timed_stage("similar_scan"):
+        similar_files = find_similar_files(metadata, latest_file, output_dir)
+        # 標題不同的重新上傳也要抓出來：以音訊指紋比對整個音樂庫
+        fingerprint_matches = find_fingerprint_matches(fingerprint, latest_file)
+    known_paths = {path for path, _ in similar_files}
+    for path, file_meta in fingerprint_matches:
+        if path not in known_paths:
+            similar_files.append((path, file_meta))
+            print(f"音訊指紋相同: {path}")
+
+    if similar_files:
+        print("\n⚠️ 發現有標題和時長相同或音訊內容相同的歌曲存在！可能是重複下載。")
+        print("\n=== 現有相似檔案 ===")
+        for i, (file_path, file_meta) in enumerate(similar_files):
+            print(f"\n[檔案 {i+1}]")
+            print(f"檔名: {os.path.basename(file_path)}")
+            print(f"標題: {file_meta['title']}")
+            print(f"演出者: {file_meta['artist']}")
+            print(f"時長: {file_meta['duration']}")
+            if file_meta['album'] != '未知專輯':
+                print(f"專輯: {file_meta['album']}")
+            print(f"檔案大小: {get_file_size(file_path)}")
+            print(f"路徑: {file_path}")
+
+        print("\n=== 剛下載的檔案 ===")
+        print(f"檔名: {filename}")
+        print(f"標題: {metadata['title']}")
+        print(f"演出者: {metadata['artist']}")
+        print(f"時長: {metadata['duration']}")
+        if metadata['album'] != '未知專輯':
+            print(f"專輯: {metadata['album']}")
+        print(f"檔案大小: {file_size}")
+        print(f"路徑: {latest_file}")
+
+        action = ask("\n請選擇操作：\n1. 保留剛下載的檔案\n2. 刪除剛下載的檔案\n3. 保留全部\n請輸入選項 (1-3): ", "similar_action").strip()
+
+        if action == "2":
+            try:
+                os.remove(latest_file)
+                print(f"已刪除剛下載的檔案: {filename}")
+                # 音樂庫中已有這首歌，視為已擁有；批次中記為略過，繼續下載與之後的批次都不再下載
+                mark_video_owned(youtube_url)
+                download_status.reason = "duplicate"
+                return False
+            except Exception as e:
+                print(f"刪除檔案時發生錯誤: {str(e)}")
+        elif action == "1":
+            print("將保留剛下載的檔案，繼續處理...")
+            delete_old = ask("是否要刪除之前的相似檔案? (y/n, 預設為n): ", "similar_delete_old").lower().strip()
+            if delete_old == 'y':
+                for file_path, _ in similar_files:
                     try:
-                        os.remove(latest_file)
-                        print(f"已刪除剛下載的檔案: {filename}")
-                        return True
+                        os.remove(file_path)
+                        remove_from_library_index(file_path)
+                        print(f"已刪除舊檔案: {os.path.basename(file_path)}")
                     except Exception as e:
-                        print(f"刪除檔案時發生錯誤: {str(e)}")
-                elif action == "1":
-                    print("將保留剛下載的檔案，繼續處理...")
-                    delete_old = input("是否要刪除之前的相似檔案? (y/n, 預設為n): ").lower().strip()
-                    if delete_old == 'y':
-                        for file_path, _ in similar_files:
-                            try:
-                                os.remove(file_path)
-                                print(f"已刪除舊檔案: {os.path.basename(file_path)}")
-                            except Exception as e:
-                                print(f"刪除舊檔案時發生錯誤: {str(e)}")
-                else:
-                    print("將保留所有檔案，繼續處理...")
-
-            new_name = input("請輸入新檔名（直接按Enter保持原檔名，無需.mp3副檔名）: ")
-            if new_name:
-                new_filepath = f"{output_dir}/{sanitize_filename(new_name)}.mp3"
-                if os.path.exists(new_filepath) and new_filepath != latest_file:
-                    print(f"\n⚠️ 警告：檔案「{os.path.basename(new_filepath)}」已存在!")
-                    overwrite = input("是否覆蓋現有檔案? (y/n, 預設為n): ").lower().strip()
-                    if overwrite == 'y':
-                        try:
-                            os.remove(new_filepath)
-                            os.rename(latest_file, new_filepath)
-                            filename = os.path.basename(new_filepath)
-                            latest_file = new_filepath
-                            print(f"已覆蓋並重新命名為: {filename}")
-                        except Exception as e:
-                            print(f"覆蓋檔案時發生錯誤: {str(e)}")
-                    else:
-                        print("將進入手動命名流程...")
-                        while True:
-                            manual_name = input("請輸入一個不重複的新檔名（無需.mp3副檔名）: ")
-                            if not manual_name:
-                                print("檔名不能為空，請重新輸入。")
-                                continue
-
-                            manual_filepath = f"{output_dir}/{sanitize_filename(manual_name)}.mp3"
-                            if os.path.exists(manual_filepath) and manual_filepath != latest_file:
-                                print(f"檔案「{os.path.basename(manual_filepath)}」也已存在，請再試一次。")
-                            else:
-                                try:
-                                    os.rename(latest_file, manual_filepath)
-                                    filename = os.path.basename(manual_filepath)
-                                    latest_file = manual_filepath
-                                    print(f"已重新命名為: {filename}")
-                                    break
-                                except Exception as e:
-                                    print(f"重新命名檔案時發生錯誤: {str(e)}")
-                                    break
+                        print(f"刪除舊檔案時發生錯誤: {str(e)}")
+        else:
+            print("將保留所有檔案，繼續處理...")
+
+    # latest_file 位於本機暫存區，重新命名只在暫存區進行，並以分類資料夾中的檔名判斷是否衝突
+    # 保持原檔名時也要檢查：搬移會以 os.replace 覆蓋分類資料夾或其他下載中同名的檔案
+    extension = os.path.splitext(filename)[1]
+    if file_name:
+        new_name = file_name
+        print(f"使用指定的檔名: {new_name}")
+    else:
+        new_name = ask(f"請輸入新檔名（直接按Enter保持原檔名，無需{extension}副檔名）: ", "rename")
+    new_filepath = f"{output_dir}/{sanitize_filename(new_name)}{extension}" if new_name else f"{output_dir}/{filename}"
+    if final_path_exists(new_filepath):
+        print(f"\n⚠️ 警告：檔案「{os.path.basename(new_filepath)}」已存在!")
+        if is_move_pending(new_filepath):
+            # 同名的檔案還在等待搬移，無法覆蓋，自動加上編號
+            print("同名的檔案正在搬移中，將自動加上編號")
+            overwrite = 'n'
+        else:
+            overwrite = ask("是否覆蓋現有檔案? (y/n, 預設為n): ", "name_conflict_overwrite").lower().strip()
+        if overwrite == 'y':
+            try:
+                if os.path.exists(new_filepath):
+                    os.remove(new_filepath)
+                remove_from_library_index(new_filepath)
+                latest_file = rename_staged_file(latest_file, os.path.basename(new_filepath))
+                filename = os.path.basename(latest_file)
+                print(f"已覆蓋並重新命名為: {filename}")
+            except Exception as e:
+                print(f"覆蓋檔案時發生錯誤: {str(e)}")
+        elif "name_conflict_overwrite" in prompt_policies or is_move_pending(new_filepath):
+            # 無人值守或同名檔案搬移中時不進入手動命名，自動加上編號
+            try:
+                base_name = os.path.splitext(os.path.basename(new_filepath))[0]
+                latest_file = rename_staged_file(latest_file, next_free_name(output_dir, base_name, extension))
+                filename = os.path.basename(latest_file)
+                print(f"已重新命名為: {filename}")
+            except Exception as e:
+                print(f"重新命名檔案時發生錯誤: {str(e)}")
+        else:
+            print("將進入手動命名流程...")
+            while True:
+                manual_name = input(f"請輸入一個不重複的新檔名（無需{extension}副檔名）: ")
+                if not manual_name:
+                    print("檔名不能為空，請重新輸入。")
+                    continue
+
+                manual_filepath = f"{output_dir}/{sanitize_filename(manual_name)}{extension}"
+                if final_path_exists(manual_filepath):
+                    print(f"檔案「{os.path.basename(manual_filepath)}」也已存在，請再試一次。")
                 else:
                     try:
-                        os.rename(latest_file, new_filepath)
-                        filename = os.path.basename(new_filepath)
-                        latest_file = new_filepath
+                        latest_file = rename_staged_file(latest_file, os.path.basename(manual_filepath))
+                        filename = os.path.basename(latest_file)
                         print(f"已重新命名為: {filename}")
+                        break
                     except Exception as e:
                         print(f"重新命名檔案時發生錯誤: {str(e)}")
+                        break
+    elif os.path.basename(new_filepath) != filename:
+        try:
+            latest_file = rename_staged_file(latest_file, os.path.basename(new_filepath))
+            filename = os.path.basename(latest_file)
+            print(f"已重新命名為: {filename}")
+        except Exception as e:
+            print(f"重新命名檔案時發生錯誤: {str(e)}")
 
-            metadata = get_mp3_metadata(latest_file)
+    metadata = get_audio_metadata(latest_file)
 
-            should_continue, row_to_update = check_duplicate_and_handle(filename, metadata, latest_file, category)
+    with timed_stage("duplicate_check"):
+        should_continue, row_to_update = check_duplicate_and_handle(filename, metadata, latest_file, category)
 
-            if should_continue:
-                if row_to_update:
-                    update_existing_record(row_to_update, filename, youtube_url, latest_file, metadata, category)
-                else:
-                    add_record_to_google_sheet(filename, youtube_url, latest_file, metadata, category)
-                return True
-            else:
-                print("由於重複檢查結果，不添加新記錄。")
-                return False
+    if should_continue:
+        if row_to_update:
+            update_existing_record(row_to_update, filename, youtube_url, latest_file, metadata, category)
         else:
-            print("找不到下載的檔案。")
+            add_record_to_google_sheet(filename, youtube_url, latest_file, metadata, category)
+        # 已擁有的標記與批次日誌的完成狀態都等到搬移確認後才寫入
+        queue_file_move(latest_file, os.path.join(output_dir, filename), metadata, fingerprint, youtube_url, on_moved)
+        return True
+    else:
+        print("由於重複檢查結果，不添加新記錄。")
+        download_status.reason = "duplicate"
+        return False
+
+def get_transcode_pool():
+    global transcode_pool
+    with transcode_pool_lock:
+        if transcode_pool is None:
+            transcode_pool = ThreadPoolExecutor(max_workers=transcode_workers)
+        return transcode_pool
+
+def build_audio_tags(info):
+    """依 yt-dlp 的影片資訊組出要寫入的標籤（對應原本 --embed-metadata 寫入的欄位）"""
+    info = info or {}
+    upload_date = info.get('upload_date') or ''
+    tags = {
+        'title': info.get('track') or info.get('title'),
+        'artist': info.get('artist') or info.get('creator') or info.get('uploader') or info.get('uploader_id'),
+        'album': info.get('album'),
+        'date': upload_date[:4] if len(upload_date) == 8 else upload_date,
+        'comment': info.get('webpage_url'),
+    }
+    return {key: str(value) for key, value in tags.items() if value}
+
+def detect_source_codec(info, source_path):
+    """由 yt-dlp 的 acodec 或副檔名判斷下載到的音訊編碼"""
+    acodec = ((info or {}).get('acodec') or '').split('.')[0].lower()
+    extension = os.path.splitext(source_path)[1].lower()
+    if acodec == 'mp3' or extension == '.mp3':
+        return 'mp3'
+    if acodec in ('mp4a', 'aac') or extension in ('.m4a', '.aac'):
+        return 'aac'
+    if acodec == 'opus' or extension == '.opus':
+        return 'opus'
+    if acodec == 'vorbis' or extension == '.ogg':
+        return 'vorbis'
+    return acodec or None
+
+def plan_audio_output(info, source_path, policy=None):
+    """依輸出格式策略決定 (輸出副檔名, 是否只複製串流)"""
+    policy = policy or audio_format_policy
+    codec = detect_source_codec(info, source_path)
+    if policy == "native":
+        native_extensions = {'mp3': '.mp3', 'aac': '.m4a', 'opus': '.opus', 'vorbis': '.ogg'}
+        if codec in native_extensions:
+            return native_extensions[codec], True
+    elif policy == "mp3_if_source_mp3" and codec == 'mp3':
+        return '.mp3', True
+    return '.mp3', False
+
+def convert_audio(source_path, tags, extension=".mp3", stream_copy=False):
+    """
+    在轉檔執行緒池中執行：用 ffmpeg 轉為目標格式並寫入標籤
+    stream_copy 為 True 時只複製音訊串流換成純音訊容器，否則重新編碼為 VBR 最高品質 (-q:a 0) MP3
+    回傳 (輸出檔路徑, 錯誤訊息)，成功時刪除原始音訊檔
+    """
+    output_path = os.path.splitext(source_path)[0] + extension
+    same_path = output_path == source_path
+    if same_path:
+        output_path = os.path.splitext(source_path)[0] + ".tagged" + extension
+
+    command = ["ffmpeg", "-y", "-v", "error", "-i", source_path, "-vn", "-map_metadata", "-1"]
+    if stream_copy:
+        command += ["-codec:a", "copy"]
+    else:
+        command += ["-codec:a", "libmp3lame", "-q:a", "0"]
+    if extension == ".mp3":
+        command += ["-id3v2_version", "3"]
+    for key, value in tags.items():
+        command += ["-metadata", f"{key}={value}"]
+    command.append(output_path)
+
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as e:
+        return None, str(e)
+    if result.returncode != 0:
+        return None, result.stderr
+
+    os.remove(source_path)
+    if same_path:
+        os.replace(output_path, source_path)
+        output_path = source_path
+    return output_path, ""
+
+def start_download(youtube_url, extra_params="", category=None, file_name=None):
+    """
+    下載階段：抓取最佳音訊串流到本機暫存區，成功後把轉檔交給轉檔執行緒池並立即返回，
+    呼叫的執行緒可以馬上開始下一個下載；回傳的項目交給 finish_download 完成後續處理
+    """
+    # 每次下載使用獨立的本機暫存資料夾，暫存檔與轉檔都不經過雲端硬碟
+    pending = {
+        'url': youtube_url,
+        'category': category,
+        'file_name': file_name,
+        'output_dir': get_output_directory(category),
+        'staging_dir': tempfile.mkdtemp(dir=staging_dir),
+        'reason': "",
+        'future': None,
+        'timing_item': {'url': youtube_url, 'category': category}
+    }
+    timing_context.item = pending['timing_item']
+    output_template = f"{pending['staging_dir']}/%(title)s.%(ext)s"
+    cli_args = f'{extra_params} --no-playlist -f "bestaudio/best" --no-embed-thumbnail --no-write-thumbnail'
+
+    print(f"正在處理: {youtube_url}")
+    print("正在下載...")
+    for attempt in range(1, max_download_attempts + 1):
+        bandwidth_args, bandwidth_level = bandwidth_governor.ytdlp_args()
+        ytdlp_engines.last_transfer = None
+        with timed_stage("ytdlp_download"):
+            ok, error_text, source_file, info = ytdlp_download(youtube_url, f"{cli_args} {bandwidth_args}", output_template)
+        if ok:
+            download_scheduler.record_success()
+            # 吞吐量取自進度回呼的傳輸位元組數與傳輸時間；子程序執行時沒有這項資料，只依錯誤訊號調整
+            transfer = getattr(ytdlp_engines, 'last_transfer', None)
+            if transfer:
+                bandwidth_governor.record_download(bandwidth_level, *transfer)
+            break
+
+        kind = download_scheduler.record_failure(error_text)
+        bandwidth_governor.record_failure(kind)
+        if kind == "unavailable":
+            print("影片無法取得（已刪除、私人或不存在），不再重試。")
+            break
+        if kind == "geo_blocked":
+            print("影片在目前所在地區無法觀看，不再重試。")
+            break
+        if kind == "other" or attempt == max_download_attempts:
+            break
+        print(f"第 {attempt} 次下載失敗 ({kind})，等待後重試...")
+        download_scheduler.acquire()
+
+    if not ok:
+        print(f"下載失敗: {error_text}")
+        pending['reason'] = kind
+        shutil.rmtree(pending['staging_dir'], ignore_errors=True)
+
+        if kind == "rate_limited":
+            print("\n遇到429錯誤 (Too Many Requests)，這意味著YouTube認為我們的下載行為是自動程序。")
+            print("請嘗試以下解決方案:")
+            print("1. 等待一段時間後再試")
+            print("2. 使用cookies選項重新運行此程序")
+            print("3. 使用VPN或代理改變IP地址")
+        return pending
+
+    if not source_file or not os.path.exists(source_file):
+        print("找不到下載的檔案。")
+        pending['reason'] = "file_not_found"
+        shutil.rmtree(pending['staging_dir'], ignore_errors=True)
+        return pending
+
+    extension, stream_copy = plan_audio_output(info, source_file)
+    if stream_copy:
+        print(f"來源已是 {extension[1:]} 音訊，直接複製串流不重新編碼")
+    pending['future'] = get_transcode_pool().submit(
+        convert_audio, source_file, build_audio_tags(info), extension, stream_copy
+    )
+    # 由完成時的回呼記錄轉檔耗時（含在轉檔執行緒池中排隊的時間）
+    transcode_started = time.perf_counter()
+    pending['future'].add_done_callback(
+        lambda future: record_stage("transcode", time.perf_counter() - transcode_started, pending['timing_item'])
+    )
+    return pending
+
+def finish_download(pending):
+    """等待轉檔完成後進行檔案處理（相似檔案、重新命名、重複檢查、寫入試算表、搬移）"""
+    download_status.reason = pending['reason']
+    timing_context.item = pending['timing_item']
+    if pending['future'] is None:
+        return False
+
+    try:
+        latest_file, error_text = pending['future'].result()
+        if not latest_file:
+            print(f"轉檔失敗: {error_text}")
+            download_status.reason = "transcode_failed"
+            shutil.rmtree(pending['staging_dir'], ignore_errors=True)
             return False
 
+        # 指紋計算（ffmpeg 解碼與 FFT）不必等互動鎖，先算好，各下載的計算可以同時進行
+        with timed_stage("fingerprint"):
+            fingerprint = compute_file_fingerprint(latest_file)
+
+        # 檔案後續處理含互動提示與試算表寫入，多執行緒下載時需逐一進行
+        with timed_stage("interaction_wait"):
+            interaction_lock.acquire()
+        try:
+            return handle_downloaded_file(
+                latest_file, pending['url'], pending['output_dir'], pending['category'], pending['file_name'],
+                fingerprint, pending.get('on_moved')
+            )
+        finally:
+            interaction_lock.release()
+    except Exception as e:
+        print(f"處理下載檔案時發生錯誤: {str(e)}")
+        download_status.reason = f"error: {str(e)}"
+        return False
+    finally:
+        # 檔案被刪除或未進入搬移時，順便清掉空的暫存資料夾
+        # 背景搬移完成時也會刪除暫存資料夾，可能在檢查途中就已不存在
+        try:
+            if not os.listdir(pending['staging_dir']):
+                os.rmdir(pending['staging_dir'])
+        except OSError:
+            pass
+
+def download_as_mp3(youtube_url, extra_params="", category=None, ask_category=True):
+    download_status.reason = ""
+    try:
+        if ask_category:
+            category = select_song_category()
+        return finish_download(start_download(youtube_url, extra_params, category))
     except Exception as e:
         print(f"下載時發生錯誤: {str(e)}")
+        download_status.reason = f"error: {str(e)}"
         return False
 
 def select_from_search_results(song_name, extra_params=""):
     try:
-        print(f"正在搜尋: {song_name}")
-        search_query = f"ytsearch15:{song_name}"
-        command = f'yt-dlp {extra_params} --dump-json "{search_query}"'
+        videos = get_cached_search(song_name)
+        if videos is not None:
+            print(f"使用快取的搜尋結果: {song_name}")
+            if not videos:
+                print("找不到相關影片!")
+                return None
 
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+            print("\n請從以下結果中選擇一個影片:")
+            for i, video in enumerate(videos[:search_result_count], 1):
+                print_search_result(i, video)
 
-        if result.returncode != 0:
-            print(f"搜尋失敗: {result.stderr}")
-            return None
+            selection = input("\n請輸入編號選擇影片 (輸入0取消): ")
+            return pick_search_result(videos, selection)
 
+        # 搜尋結果在背景逐筆顯示，使用者看到想要的結果即可直接輸入編號
+        print(f"正在搜尋: {song_name}")
+        print("\n請從以下結果中選擇一個影片（結果陸續顯示中，可隨時輸入編號）:")
+        search_query = f"ytsearch{search_result_count}:{song_name}"
         videos = []
-        for line in result.stdout.strip().split('\n'):
-            if line:
-                try:
-                    video_info = json.loads(line)
-                    duration = video_info.get('duration', 0)
-
-                    videos.append({
-                        'title': video_info.get('title', '未知標題'),
-                        'url': video_info.get('webpage_url', ''),
-                        'channel': video_info.get('channel', '未知頻道'),
-                        'view_count': video_info.get('view_count', 0),
-                        'view_count_text': format_view_count(video_info.get('view_count', 0)),
-                        'duration': duration,
-                        'duration_text': format_duration(duration)
-                    })
-                except json.JSONDecodeError:
-                    continue
+        stop_event = threading.Event()
+        done_event = threading.Event()
 
-        if not videos:
-            print("找不到相關影片!")
-            return None
+        def receive_results():
+            try:
+                for video_info in ytdlp_search_stream(search_query, extra_params, stop_event):
+                    videos.append(build_search_result(video_info))
+                    print_search_result(len(videos), videos[-1])
+                    if len(videos) >= search_result_count:
+                        break
+                if not stop_event.is_set():
+                    if videos:
+                        save_search_result(song_name, videos)
+                    else:
+                        print("找不到相關影片!（請輸入0取消）")
+            except Exception as e:
+                print(f"搜尋失敗: {str(e)}（請輸入0取消）")
+            finally:
+                done_event.set()
 
-        print("\n請從以下結果中選擇一個影片:")
-        for i, video in enumerate(videos[:10], 1):
-            print(f"{i}. {video['title']} - {video['channel']} ({video['view_count_text']} 觀看次數, {video['duration_text']})")
+        threading.Thread(target=receive_results, daemon=True).start()
 
         selection = input("\n請輸入編號選擇影片 (輸入0取消): ")
         try:
-            selection = int(selection)
-            if selection > 0 and selection <= len(videos):
-                selected_video = videos[selection-1]
-                print(f"\n您選擇了: {selected_video['title']}")
-                return selected_video['url']
-            else:
-                print("已取消選擇")
-                return None
+            wanted = int(selection)
         except ValueError:
-            print("無效的輸入，已取消選擇")
-            return None
+            wanted = 0
+
+        # 選擇的結果可能還沒出現，等到它出現或搜尋結束
+        while wanted > len(videos) and not done_event.is_set():
+            done_event.wait(0.1)
+
+        # 已做出選擇，取消剩餘的搜尋
+        stop_event.set()
+        return pick_search_result(videos, selection)
 
     except Exception as e:
         print(f"處理搜尋結果時發生錯誤: {str(e)}")
         return None
 
+def pick_search_result(videos, selection):
+    """依使用者輸入的編號回傳影片網址"""
+    try:
+        selection = int(selection)
+        if selection > 0 and selection <= len(videos):
+            selected_video = videos[selection-1]
+            print(f"\n您選擇了: {selected_video['title']}")
+            return selected_video['url']
+        else:
+            print("已取消選擇")
+            return None
+    except ValueError:
+        print("無效的輸入，已取消選擇")
+        return None
+
 def download_by_url(extra_params=""):
     while True:
         youtube_url = input("請輸入 YouTube 影片網址 (輸入 '0' 退出): ")
@@ -974,6 +2932,10 @@ def download_by_url(extra_params=""):
             break
 
         if "youtube.com" in youtube_url or "youtu.be" in youtube_url:
+            if is_video_owned(youtube_url):
+                again = input(f"已擁有此影片 ({extract_video_id(youtube_url)})，是否仍要下載? (y/n, 預設 n): ").lower().strip()
+                if again != 'y':
+                    continue
             download_as_mp3(youtube_url, extra_params)
         else:
             print("請輸入有效的 YouTube 網址!")
@@ -984,11 +2946,17 @@ def batch_download_urls(extra_params=""):
     urls = []
     print("請輸入多個 YouTube 網址 (每行一個，輸入空行結束):")
 
+    seen_ids = set()
     while True:
         url = input()
         if not url:
             break
         if "youtube.com" in url or "youtu.be" in url:
+            video_id = extract_video_id(url)
+            if video_id and (video_id in seen_ids or is_video_owned(url)):
+                print(f"已擁有或重複輸入的影片 ({video_id})，已略過")
+                continue
+            seen_ids.add(video_id)
             urls.append(url)
         else:
             print(f"警告: '{url}' 不像是 YouTube 網址，已略過")
@@ -1004,31 +2972,348 @@ def batch_download_urls(extra_params=""):
         print("操作已取消")
         return
 
-    apply_rate_limit = input("是否啟用下載間隔以避免429錯誤? (y/n, 預設 y): ").lower() != 'n'
-    rate_limit_args = "--limit-rate 500K --sleep-interval 10" if apply_rate_limit else ""
-    if rate_limit_args and extra_params:
-        extra_params = f"{extra_params} {rate_limit_args}"
-    elif rate_limit_args:
-        extra_params = rate_limit_args
+    # 先為每個網址選好類別，下載執行緒開始後就不需要再等待輸入
+    jobs = []
+    for i, url in enumerate(urls, 1):
+        print(f"\n第 {i}/{len(urls)} 個影片: {url}")
+        jobs.append((url, select_song_category(), None))
+
+    journal_path = create_batch_journal(jobs)
+    extra_params, workers, scheduler = prompt_batch_settings(extra_params)
+    run_batch_downloads(jobs, extra_params, workers, scheduler, journal_path)
+
+def prompt_batch_settings(extra_params=""):
+    """詢問同時下載數量與速率限制，回傳 (參數, 同時下載數量, 排程器)"""
+    try:
+        workers = int(input(f"\n同時下載數量 [預設{default_download_workers}]: ") or default_download_workers)
+    except ValueError:
+        workers = default_download_workers
+
+    requests_per_minute = 0
+    if input("是否啟用請求速率限制以避免429錯誤? (y/n, 預設 y): ").lower() != 'n':
+        try:
+            requests_per_minute = float(input(f"每分鐘最多請求數 [預設{default_requests_per_minute}]: ") or default_requests_per_minute)
+        except ValueError:
+            requests_per_minute = default_requests_per_minute
+
+    return apply_batch_settings(extra_params, workers, requests_per_minute)
+
+def apply_batch_settings(extra_params="", workers=default_download_workers, requests_per_minute=default_requests_per_minute):
+    """套用同時下載數量與速率限制 (requests_per_minute 為 0 表示不限制)，回傳 (參數, 同時下載數量, 排程器)"""
+    workers = max(1, workers)
+    apply_rate_limit = requests_per_minute > 0
+    # 頻寬不再固定限制，由 bandwidth_governor 依每次下載的吞吐量與限流訊號調整
+    bandwidth_governor.configure(apply_rate_limit)
+    if apply_rate_limit:
+        start_rate = download_scheduler.configure(requests_per_minute, default_burst)
+        print(f"已啟用速率限制：每分鐘最多 {requests_per_minute:g} 個請求（目前 {start_rate:g}），突發 {default_burst} 個")
+        print(f"每個下載的頻寬上限從 {bandwidth_governor.current_limit()} 開始，依實際吞吐量自動調整")
+        print("遇到 429 或限流時會自動降速並暫停，成功後再逐步恢復")
+
+    return extra_params, workers, download_scheduler if apply_rate_limit else None
+
+def create_batch_journal(jobs):
+    """建立新的批次日誌並寫入所有待下載項目"""
+    try:
+        os.makedirs(batch_journal_dir, exist_ok=True)
+        journal_path = os.path.join(batch_journal_dir, f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        for url, category, file_name in jobs:
+            append_journal_record(journal_path, url, category, "pending", file_name=file_name)
+        print(f"批次日誌: {journal_path}")
+        return journal_path
+    except Exception as e:
+        print(f"建立批次日誌時發生錯誤: {str(e)}，本次批次將無法中斷後繼續")
+        return None
+
+def append_journal_record(journal_path, url, category, state, reason="", file_name=None):
+    record = {
+        "url": url,
+        "category": category,
+        "file_name": file_name,
+        "state": state,
+        "reason": reason,
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    with batch_journal_lock:
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def load_batch_journal(journal_path):
+    """讀取批次日誌，回傳每個網址最後的狀態（保持原本順序）"""
+    states = {}
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 執行階段中斷時最後一行可能只寫了一半
+                continue
+            states[record["url"]] = record
+    return states
+
+def resume_batch_download(extra_params=""):
+    """列出尚未完成的批次，略過已完成的項目，重新下載其餘項目（含失敗的）"""
+    try:
+        journal_files = sorted(
+            (os.path.join(batch_journal_dir, name) for name in os.listdir(batch_journal_dir) if name.endswith(".jsonl")),
+            reverse=True
+        )
+    except OSError:
+        journal_files = []
+
+    unfinished = []
+    for journal_path in journal_files:
+        states = load_batch_journal(journal_path)
+        remaining = [record for record in states.values() if record["state"] not in ("done", "skipped")]
+        if remaining:
+            unfinished.append((journal_path, states, remaining))
+
+    if not unfinished:
+        print("沒有未完成的批次下載。")
+        return
+
+    print("\n未完成的批次下載:")
+    for i, (journal_path, states, remaining) in enumerate(unfinished, 1):
+        failed = sum(1 for record in remaining if record["state"] == "failed")
+        print(f"{i}. {os.path.basename(journal_path)} - 共 {len(states)} 個，剩餘 {len(remaining)} 個（其中失敗 {failed} 個）")
+
+    try:
+        journal_path, states, remaining = unfinished[int(input("請選擇要繼續的批次 (輸入0取消): ")) - 1]
+    except (ValueError, IndexError):
+        print("操作已取消")
+        return
+
+    jobs = [(record["url"], record["category"], record.get("file_name")) for record in remaining]
+    print(f"將略過 {len(states) - len(jobs)} 個已完成的項目，繼續下載 {len(jobs)} 個影片")
+    extra_params, workers, scheduler = prompt_batch_settings(extra_params)
+    run_batch_downloads(jobs, extra_params, workers, scheduler, journal_path)
 
-    print(f"\n開始下載 {len(urls)} 個影片...")
+def run_batch_downloads(jobs, extra_params="", workers=default_download_workers, rate_limiter=None, journal_path=None):
+    """
+    以多執行緒同時下載 jobs 中的 (網址, 類別, 指定檔名)，請求節奏由共用的下載排程器控制
+    jobs 也可以是逐筆產生項目的產生器（例如播放清單），取得一筆就開始下載，總數在清單結束後才確定
+    提供 journal_path 時，每個項目的狀態變化都會寫入批次日誌
+    回傳成功或因與音樂庫重複而略過的項目數
+    """
+    streaming = not isinstance(jobs, (list, tuple))
+    total = "?" if streaming else len(jobs)
     success_count = 0
+    skipped_count = 0
+    progress_lock = threading.Lock()
+    timing_name = os.path.splitext(os.path.basename(journal_path))[0] if journal_path else f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    timing_log_path = start_timing_log(timing_name)
 
-    for i, url in enumerate(urls, 1):
-        print(f"\n處理第 {i}/{len(urls)} 個影片:")
+    def record_state(url, category, file_name, state, reason=""):
+        if journal_path:
+            try:
+                append_journal_record(journal_path, url, category, state, reason, file_name)
+            except Exception as e:
+                print(f"寫入批次日誌時發生錯誤: {str(e)}")
+
+    def download_job(index, url, category, file_name):
+        if rate_limiter:
+            with timed_stage("rate_wait", {'url': url, 'category': category}):
+                rate_limiter.acquire()
+        print(f"\n處理第 {index}/{total} 個影片: {url}")
+        record_state(url, category, file_name, "downloading")
+        pending = start_download(url, extra_params, category, file_name)
+        # 搬移執行緒的 on_moved 可能比 finish_job 更早寫入日誌；以項目自己的鎖與狀態排定先後，
+        # 搬移已結束時 finish_job 不再寫入 moving，避免覆蓋 done
+        move_state = {"lock": threading.Lock(), "finished": False}
+
+        def on_moved(moved):
+            with move_state["lock"]:
+                move_state["finished"] = True
+                record_state(url, category, file_name, "done" if moved else "failed", "" if moved else "move_failed")
+
+        pending['on_moved'] = on_moved
+        # 轉檔與後續處理交給另一組執行緒等待，這個下載執行緒立即去處理下一個網址
+        return finish_executor.submit(finish_job, index, url, category, file_name, pending, move_state)
+
+    def finish_job(index, url, category, file_name, pending, move_state):
+        nonlocal success_count, skipped_count
+        ok = finish_download(pending)
+        reason = getattr(download_status, "reason", "")
+        if ok:
+            # 檔案還在本機暫存區，搬移到雲端硬碟並確認大小後才由 on_moved 記為 done
+            with move_state["lock"]:
+                if not move_state["finished"]:
+                    record_state(url, category, file_name, "moving")
+        elif reason == "duplicate":
+            # 已由重複檢查處理（例如使用者選擇刪除新檔），繼續時不需要重新下載
+            record_state(url, category, file_name, "skipped", reason)
+        else:
+            record_state(url, category, file_name, "failed", reason)
+
+        with progress_lock:
+            if ok:
+                success_count += 1
+                print(f"進度：{success_count}/{total} 完成")
+            elif reason == "duplicate":
+                skipped_count += 1
+                print(f"已略過重複：{index}/{total}")
+            else:
+                print(f"下載失敗：{index}/{total}")
+        return ok
+
+    if streaming:
+        print(f"\n邊列出清單邊下載（同時下載 {workers} 個，轉檔執行緒 {transcode_workers} 個）...")
+    else:
+        print(f"\n開始下載 {total} 個影片（同時下載 {workers} 個，轉檔執行緒 {transcode_workers} 個）...")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            ThreadPoolExecutor(max_workers=workers + transcode_workers) as finish_executor:
+        futures = {}
+        try:
+            for i, (url, category, file_name) in enumerate(jobs, 1):
+                if streaming:
+                    record_state(url, category, file_name, "pending")
+                futures[executor.submit(download_job, i, url, category, file_name)] = i
+        except Exception as e:
+            print(f"列出清單時發生錯誤: {str(e)}，已排入的 {len(futures)} 個影片會繼續下載")
+        total = len(futures)
+
+        finish_futures = []
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                finish_futures.append(future.result())
+            except Exception as e:
+                print(f"第 {index} 個影片處理時發生錯誤: {str(e)}")
+                with progress_lock:
+                    print(f"下載失敗：{index}/{total}")
+
+        for future in as_completed(finish_futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"處理下載檔案時發生錯誤: {str(e)}")
+
+    wait_for_pending_moves()
+    flush_sheet_writes()
+    print(f"\n下載完成! 成功: {success_count}/{total}" + (f"，略過重複: {skipped_count}" if skipped_count else ""))
+    print_timing_summary()
+    bandwidth_governor.print_summary()
+    if timing_log_path:
+        print(f"各階段耗時明細: {timing_log_path}")
+    return success_count + skipped_count
+
+def normalize_playlist_url(url):
+    """頻道網址只列出「影片」分頁，避免把短片與直播分頁當成巢狀清單"""
+    url = url.strip()
+    if re.search(r'youtube\.com/(@[^/?#]+|channel/[^/?#]+|c/[^/?#]+|user/[^/?#]+)/?$', url):
+        return url.rstrip('/') + '/videos'
+    return url
+
+def stream_playlist_jobs(playlist_url, category=None, extra_params="", skip_owned=True, stop_event=None):
+    """
+    以扁平擷取逐筆列出播放清單或頻道中的影片，產生批次項目 (網址, 類別, 檔名)；
+    不等待整個清單解析完成，前面的影片可以先開始下載。已擁有、重複或無法取得的影片直接略過
+    """
+    seen_ids = set()
+    listed = skipped = 0
+    for entry in ytdlp_search_stream(normalize_playlist_url(playlist_url), extra_params, stop_event):
+        listed += 1
+        video = build_search_result(entry)
+        video_id = extract_video_id(video['url'])
+        if not video_id or video['title'] in ("[Private video]", "[Deleted video]"):
+            print(f"清單第 {listed} 項無法取得，已略過: {video['title']}")
+            continue
+        if video_id in seen_ids or (skip_owned and is_video_owned(video['url'])):
+            skipped += 1
+            continue
+        seen_ids.add(video_id)
+        yield video['url'], category, None
+    print(f"\n清單共列出 {listed} 項，略過已擁有或重複的 {skipped} 項")
+
+def download_playlist(extra_params=""):
+    """下載播放清單或頻道：邊列出邊下載，全部使用同一個類別"""
+    playlist_url = input("請輸入 YouTube 播放清單或頻道網址: ").strip()
+    if "youtube.com" not in playlist_url and "youtu.be" not in playlist_url:
+        print("請輸入有效的 YouTube 網址!")
+        return
+
+    category = select_song_category()
+    journal_path = create_batch_journal([])
+    extra_params, workers, scheduler = prompt_batch_settings(extra_params)
+    jobs = stream_playlist_jobs(playlist_url, category, extra_params)
+    run_batch_downloads(jobs, extra_params, workers, scheduler, journal_path)
+
+def review_search_results(song_name, ranked):
+    """讓使用者從排序後的結果中手動選擇，回傳影片網址或 None"""
+    print(f"\n「{song_name}」沒有足夠把握的結果，請手動確認:")
+    for i, (score, video) in enumerate(ranked[:search_result_count], 1):
+        print_search_result(i, video)
+        print(f"   分數 {score:.2f}")
+    selection = input("請輸入編號選擇影片 (輸入0略過): ")
+    return pick_search_result([video for _, video in ranked], selection)
+
+def batch_search_download(extra_params=""):
+    """
+    批次輸入歌名：同時搜尋並自動採用分數達到門檻的最佳結果，
+    分數不足的歌名在全部搜尋完成後集中手動確認，確認完再一起批次下載
+    """
+    print("請輸入多個歌曲名稱 (每行一個，可加上「| 類別」，輸入空行結束):")
+    lines = []
+    while True:
+        line = input()
+        if not line:
+            break
+        lines.append(line)
+    if not lines:
+        print("沒有輸入歌曲名稱，操作已取消")
+        return
 
-        if download_as_mp3(url, extra_params):
-            success_count += 1
-            print(f"進度：{success_count}/{len(urls)} 完成")
+    default_category = select_song_category()
+    entries = []
+    for line_number, line in enumerate(lines, 1):
+        try:
+            entries.append(parse_job_line(line, default_category))
+        except ValueError as e:
+            print(f"第 {line_number} 行: {str(e)}，已略過")
+
+    song_names = [target for target, _, _ in entries]
+    print(f"\n正在同時搜尋 {len(song_names)} 首歌曲...")
+    results = resolve_song_names(song_names, extra_params)
+
+    jobs = []
+    review = []
+    seen_ids = set()
+    for (song_name, category, file_name), (ranked, _) in zip(entries, results):
+        if not ranked:
+            continue
+        best_score, best = ranked[0]
+        if best_score >= search_confidence_threshold:
+            jobs.append((best['url'], category, file_name))
         else:
-            print(f"下載失敗：{i}/{len(urls)}")
+            review.append((song_name, category, file_name, ranked))
+
+    if review:
+        print(f"\n共有 {len(review)} 首歌曲需要手動確認")
+        for song_name, category, file_name, ranked in review:
+            url = review_search_results(song_name, ranked)
+            if url:
+                jobs.append((url, category, file_name))
+
+    unique_jobs = []
+    for url, category, file_name in jobs:
+        video_id = extract_video_id(url)
+        if video_id in seen_ids or is_video_owned(url):
+            print(f"已擁有或重複的影片 ({video_id})，已略過")
+            continue
+        seen_ids.add(video_id)
+        unique_jobs.append((url, category, file_name))
 
-        if i < len(urls) and apply_rate_limit:
-            pause_sec = 5
-            print(f"等待 {pause_sec} 秒後下載下一個影片...")
-            time.sleep(pause_sec)
+    if not unique_jobs:
+        print("沒有需要下載的項目")
+        return
 
-    print(f"\n下載完成! 成功: {success_count}/{len(urls)}")
+    print(f"\n共有 {len(unique_jobs)} 個影片等待下載")
+    journal_path = create_batch_journal(unique_jobs)
+    extra_params, workers, scheduler = prompt_batch_settings(extra_params)
+    run_batch_downloads(unique_jobs, extra_params, workers, scheduler, journal_path)
 
 def download_song_with_manual_selection(extra_params=""):
     while True:
@@ -1038,37 +3323,241 @@ def download_song_with_manual_selection(extra_params=""):
 
         youtube_url = select_from_search_results(song_name, extra_params)
         if youtube_url:
+            if is_video_owned(youtube_url):
+                again = input("已擁有此影片，是否仍要下載? (y/n, 預設 n): ").lower().strip()
+                if again != 'y':
+                    continue
             download_as_mp3(youtube_url, extra_params)
         else:
             print("搜尋失敗或已取消選擇，請重新輸入歌曲名稱")
 
     print("程式已結束")
 
-print("進階 YouTube 音樂下載器 (優化版) - 解決429錯誤")
-print("檔案將儲存至:", output_dir)
-
-print("\n== 防止YouTube 429錯誤設置 ==")
-extra_params = setup_cookies()
-
-if extra_params:
-    test_youtube_connection(extra_params)
-
-print("\n== 初始化 Google Sheets ==")
-if not initialize_google_sheet():
-    print("警告：無法初始化 Google Sheets，下載記錄可能無法保存。")
-
-print("\n== 請選擇下載模式 ==")
-print("1. 輸入 YouTube 網址下載")
-print("2. 批次下載多個 YouTube 網址")
-print("3. 輸入歌曲名稱下載 (手動選擇)")
-
-choice = input("請選擇模式 (1/2/3): ")
-if choice == "1":
-    download_by_url(extra_params)
-elif choice == "2":
-    batch_download_urls(extra_params)
-elif choice == "3":
-    download_song_with_manual_selection(extra_params)
-else:
-    print("無效的選擇，默認使用 YouTube 網址下載模式")
-    download_by_url(extra_params)
+def parse_command_line(argv=None):
+    """
+    解析無人值守模式的命令列參數；在 Colab/Jupyter 中執行或沒有任何參數時回傳 None，改用互動選單
+    """
+    if argv is None:
+        if "ipykernel" in sys.modules or os.path.basename(sys.argv[0]).startswith("ipykernel"):
+            return None
+        argv = sys.argv[1:]
+    if not argv:
+        return None
+
+    parser = argparse.ArgumentParser(
+        description="無人值守批次下載：從檔案或標準輸入讀取網址或歌名，所有提示依策略自動回答",
+        epilog="輸入每行格式：網址或歌名[<Tab 或 |>類別[<Tab 或 |>檔名]]，類別可用名稱或編號 (0-4)"
+    )
+    parser.add_argument("input", nargs="?", default="-", help="輸入檔案路徑，- 代表標準輸入（預設）")
+    parser.add_argument("--category", default="0", help="輸入行未指定類別時使用的類別（預設不分類）")
+    parser.add_argument("--on-owned", choices=["skip", "download"], default="skip",
+                        help="已擁有的影片：略過或仍然下載（預設略過）")
+    parser.add_argument("--on-low-confidence", choices=["skip", "best"], default="skip",
+                        help="歌名的最佳搜尋結果分數低於門檻時：略過並列出候選結果，或仍採用最佳結果（預設略過）")
+    parser.add_argument("--min-confidence", type=float, default=search_confidence_threshold,
+                        help=f"自動採用搜尋結果的分數門檻 0-1（預設 {search_confidence_threshold}）")
+    parser.add_argument("--on-similar", choices=["keep-all", "keep-new", "replace-old", "delete-new"], default="keep-all",
+                        help="發現相似檔案時：全部保留、保留新檔、保留新檔並刪除舊檔、刪除新檔（預設全部保留）")
+    parser.add_argument("--on-duplicate", choices=["skip", "overwrite"], default="skip",
+                        help="試算表中已有完全相同且較大的檔案時：刪除新檔或覆蓋記錄（預設刪除新檔）")
+    parser.add_argument("--on-name-conflict", choices=["keep-both", "overwrite"], default="keep-both",
+                        help="檔名已存在時：保留兩者（自動加上編號或另存版本）或覆蓋（預設保留兩者）")
+    parser.add_argument("--format", choices=audio_format_policies, default=audio_format_policy,
+                        help=f"輸出格式策略（預設 {audio_format_policy}）")
+    parser.add_argument("--workers", type=int, default=default_download_workers, help="同時下載數量")
+    parser.add_argument("--rpm", type=float, default=default_requests_per_minute,
+                        help="每分鐘最多請求數，0 表示不限制")
+    parser.add_argument("--cookies", help="Netscape 格式的 YouTube cookies 檔案")
+    parser.add_argument("--user-agent", help="自訂 User-Agent")
+    parser.add_argument("--ytdlp-args", default="", help="額外傳給 yt-dlp 的參數")
+    parser.add_argument("--playlist", help="改為下載播放清單或頻道中的所有影片（邊列出邊下載），不讀取輸入")
+    parser.add_argument("--fingerprint", action="store_true", help="只建立音訊指紋索引，不下載")
+    parser.add_argument("--reconcile", action="store_true", help="只核對音樂庫資料夾與試算表記錄，不下載")
+    parser.add_argument("--fix", action="store_true", help="與 --reconcile 一起使用：自動修正不一致的記錄")
+    parser.add_argument("--music-dir", help="音樂資料夾（預設為雲端硬碟的 MUSIC 資料夾或 ~/Music/MUSIC）")
+    args = parser.parse_args(argv)
+
+    try:
+        args.category = parse_category(args.category)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+def parse_job_line(line, default_category):
+    """解析一行輸入「網址或歌名[<Tab 或 |>類別[<Tab 或 |>檔名]]」，回傳 (網址或歌名, 類別, 檔名)"""
+    fields = [field.strip() for field in re.split(r"\t|\s*\|\s*", line.strip())]
+    category = parse_category(fields[1]) if len(fields) > 1 and fields[1] else default_category
+    file_name = sanitize_filename(fields[2]) if len(fields) > 2 and fields[2] else None
+    return fields[0], category, file_name
+
+def read_headless_jobs(lines, default_category, extra_params="", on_owned="skip", on_low_confidence="skip"):
+    """
+    將輸入行轉為批次項目 (網址, 類別, 檔名)；歌名會同時搜尋並採用分數最高的結果，
+    分數低於門檻時依 on_low_confidence 略過（列出候選結果供之後手動處理）或仍採用
+    """
+    entries = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            entries.append((line_number,) + parse_job_line(line, default_category))
+        except ValueError as e:
+            print(f"第 {line_number} 行: {str(e)}，已略過")
+
+    song_names = [target for _, target, _, _ in entries if "youtube.com" not in target and "youtu.be" not in target]
+    resolved = dict(zip(song_names, resolve_song_names(song_names, extra_params))) if song_names else {}
+
+    jobs = []
+    seen_ids = set()
+    for line_number, target, category, file_name in entries:
+        if target not in resolved:
+            url = target
+        else:
+            ranked, _ = resolved[target]
+            if not ranked:
+                print(f"第 {line_number} 行: 找不到「{target}」的搜尋結果，已略過")
+                continue
+            best_score, best = ranked[0]
+            url = best['url']
+            if best_score < search_confidence_threshold and on_low_confidence == "skip":
+                print(f"第 {line_number} 行: 「{target}」沒有足夠把握的結果，已略過，請手動確認:")
+                for score, video in ranked[:3]:
+                    print(f"    {score:.2f}  {video['title']} - {video['channel']} ({video['url']})")
+                continue
+            print(f"第 {line_number} 行: 「{target}」→ {best['title']} ({url}, 分數 {best_score:.2f})")
+
+        video_id = extract_video_id(url)
+        if video_id and video_id in seen_ids:
+            print(f"第 {line_number} 行: 重複輸入的影片 ({video_id})，已略過")
+            continue
+        if on_owned == "skip" and is_video_owned(url):
+            print(f"第 {line_number} 行: 已擁有的影片 ({video_id})，已略過")
+            continue
+        seen_ids.add(video_id)
+        jobs.append((url, category, file_name))
+    return jobs
+
+def run_headless(args):
+    """依命令列參數執行，不等待任何輸入"""
+    global audio_format_policy, search_confidence_threshold
+    audio_format_policy = args.format
+    search_confidence_threshold = args.min_confidence
+
+    similar_answers = {
+        "keep-all": ("3", "n"),
+        "keep-new": ("1", "n"),
+        "replace-old": ("1", "y"),
+        "delete-new": ("2", "n")
+    }
+    prompt_policies["similar_action"], prompt_policies["similar_delete_old"] = similar_answers[args.on_similar]
+    prompt_policies["duplicate_overwrite"] = "y" if args.on_duplicate == "overwrite" else "n"
+    prompt_policies["name_conflict_overwrite"] = "y" if args.on_name_conflict == "overwrite" else "n"
+    prompt_policies["rename"] = ""
+
+    extra_params = args.ytdlp_args
+    if args.cookies:
+        extra_params = f'{extra_params} --cookies "{args.cookies}"'
+    if args.user_agent:
+        extra_params = f'{extra_params} --user-agent "{args.user_agent}"'
+    extra_params = extra_params.strip()
+
+    if not initialize_google_sheet():
+        print("警告：無法初始化 Google Sheets，下載記錄可能無法保存。")
+
+    if args.fingerprint:
+        fingerprint_library()
+        return 0
+
+    if args.reconcile:
+        mismatches = reconcile_library(args.fix)
+        return 1 if mismatches and not args.fix else 0
+
+    if args.playlist:
+        journal_path = create_batch_journal([])
+        extra_params, workers, scheduler = apply_batch_settings(extra_params, args.workers, args.rpm)
+        jobs = stream_playlist_jobs(args.playlist, args.category, extra_params, args.on_owned == "skip")
+        run_batch_downloads(jobs, extra_params, workers, scheduler, journal_path)
+        return 0
+
+    if args.input == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+
+    jobs = read_headless_jobs(lines, args.category, extra_params, args.on_owned, args.on_low_confidence)
+    if not jobs:
+        print("沒有需要下載的項目")
+        return 0
+
+    journal_path = create_batch_journal(jobs)
+    extra_params, workers, scheduler = apply_batch_settings(extra_params, args.workers, args.rpm)
+    completed = run_batch_downloads(jobs, extra_params, workers, scheduler, journal_path)
+    return 0 if completed == len(jobs) else 1
+
+def main(argv=None):
+    """程式進入點：有命令列參數時以無人值守模式執行，否則顯示互動選單"""
+    command_line = parse_command_line(argv)
+    configure_storage(command_line.music_dir if command_line else None)
+
+    print("進階 YouTube 音樂下載器 (優化版) - 解決429錯誤")
+    print("檔案將儲存至:", base_output_dir)
+
+    exit_code = 0
+    if command_line:
+        exit_code = run_headless(command_line)
+    else:
+        print("\n== 防止YouTube 429錯誤設置 ==")
+        extra_params = setup_cookies()
+
+        if extra_params:
+            test_youtube_connection(extra_params)
+
+        print("\n== 初始化 Google Sheets ==")
+        if not initialize_google_sheet():
+            print("警告：無法初始化 Google Sheets，下載記錄可能無法保存。")
+
+        print("\n== 請選擇下載模式 ==")
+        print("1. 輸入 YouTube 網址下載")
+        print("2. 批次下載多個 YouTube 網址")
+        print("3. 輸入歌曲名稱下載 (手動選擇)")
+        print("4. 繼續未完成的批次下載")
+        print("5. 建立音訊指紋索引（找出標題不同的重複歌曲）")
+        print("6. 下載播放清單或頻道（邊列出邊下載）")
+        print("7. 批次輸入歌曲名稱下載 (自動挑選最佳結果)")
+        print("8. 核對音樂庫與試算表記錄")
+
+        choice = input("請選擇模式 (1-8): ")
+        if choice == "1":
+            download_by_url(extra_params)
+        elif choice == "2":
+            batch_download_urls(extra_params)
+        elif choice == "3":
+            download_song_with_manual_selection(extra_params)
+        elif choice == "4":
+            resume_batch_download(extra_params)
+        elif choice == "5":
+            fingerprint_library()
+        elif choice == "6":
+            download_playlist(extra_params)
+        elif choice == "7":
+            batch_search_download(extra_params)
+        elif choice == "8":
+            if reconcile_library():
+                fix = input("是否自動修正以上不一致的項目? (y/n, 預設 n): ").lower().strip()
+                if fix == 'y':
+                    reconcile_library(fix=True)
+        else:
+            print("無效的選擇，默認使用 YouTube 網址下載模式")
+            download_by_url(extra_params)
+
+    # 結束前等待背景搬移完成，並把寫入佇列中剩餘的記錄寫出
+    wait_for_pending_moves()
+    flush_sheet_writes()
+    return exit_code
+
+if __name__ == "__main__":
+    exit_code = main()
+    if exit_code:
+        sys.exit(exit_code)